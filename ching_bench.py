@@ -0,0 +1,480 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import genetic_ching4
+from genetic_ching4 import GeneticMusic, MotifPopulation
+
+
+# Benchmark harness for the GA hot path and the rendering path. Every case
+# runs with fixed seeds and reports a throughput (generations, individuals or
+# MIDI files per second) plus the peak memory the case allocates. Each timed
+# sample repeats the case for at least SAMPLE_TIME and the fastest time per
+# call over many samples is reported (see time_case). Results
+# are saved as JSON and can be compared against a stored baseline:
+#
+#   python3 ching_bench.py --output bench.json
+#   python3 ching_bench.py --baseline bench.json --tolerance 0.2
+
+SEED = 1234
+HEXAGRAM = 20
+MODE = 2
+
+FULL_GRID = {
+    'population_sizes': [10, 100, 1000, 10000, 100000],
+    'generations': [10, 100],
+    'motif_lengths': [6, 24, 96],
+}
+QUICK_GRID = {
+    'population_sizes': [10, 1000],
+    'generations': [10],
+    'motif_lengths': [6, 24],
+}
+# Cold start of a fresh interpreter, in seconds: importing genetic_ching4, and
+# a full command line run of STARTUP_ARGS (what a generate request from Max
+# costs when the generator server is not running). The fastest of at least
+# STARTUP_RUNS cold starts is kept, and the CLI run must stay within
+# STARTUP_BUDGET. Reference: on a single-core Linux VM (Python 3.11,
+# NumPy 2.4) single runs took 0.20-0.31 s and the best of 5 0.20-0.25 s,
+# so the budget leaves about 60% headroom.
+STARTUP_BUDGET = 0.4
+STARTUP_RUNS = 5
+STARTUP_ARGS = ['--generations', '10', '--population', '10', '--hexagram', str(HEXAGRAM),
+                '--base_duration', '4', '--mutation_rate', '0.3', '--harmonicity_ratio', '0.3',
+                '--dynamic_ratio', '0.8', '--seed', str(SEED)]
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Timing (see time_case): every sample repeats a case's call for at least
+# SAMPLE_TIME seconds, and samples are taken until CASE_TIME seconds of them
+SAMPLE_TIME = 0.01
+CASE_TIME = 1.0
+
+# save_as_midi writes into a RAM-backed directory where there is one (Linux),
+# so the case times encoding and file creation rather than disk writeback,
+# which varied threefold between runs on a virtual machine
+MIDI_WORKDIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# The list-based operators run in interpreted Python; larger sizes only
+# measure how slow that is
+SCALAR_LIMIT = 10000
+
+
+# Peak memory allocated while one case runs, in kB, from an extra traced
+# run (tracing slows allocation, so it is kept out of the timed runs).
+# ru_maxrss would not do: it is the peak of the whole process and never
+# comes down after the first large case. tracemalloc also sees NumPy arrays.
+def peak_memory_kb(function, params):
+    tracemalloc.start()
+    try:
+        function(**params)
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+# A GeneticMusic whose motifs are `motif_length` slots long: a long-form
+# phrase repeating the benchmark hexagram
+def make_music(motif_length=6):
+    return GeneticMusic([HEXAGRAM] * (motif_length // 6), 4, 0.3, cache_size=0, seed=SEED)
+
+
+def make_population(gm, size):
+    return gm.generate_initial_population(size, MODE)
+
+
+def bench_fitness_function(size, motif_length, number=1):
+    gm = make_music(motif_length)
+    population = make_population(gm, size)
+    start = time.perf_counter()
+    for _ in range(number):
+        for motif in population:
+            gm.fitness_function(motif, MODE)
+    return time.perf_counter() - start, size, 'individuals'
+
+
+def bench_fitness_batch(size, motif_length, number=1):
+    gm = make_music(motif_length)
+    motifs = np.array(make_population(gm, size))
+    start = time.perf_counter()
+    for _ in range(number):
+        gm.fitness_batch(motifs, MODE)
+    return time.perf_counter() - start, size, 'individuals'
+
+
+def bench_select_parents(size, motif_length, number=1):
+    gm = make_music(motif_length)
+    population = make_population(gm, size)
+    scores = gm.fitness_batch(population, MODE)
+    start = time.perf_counter()
+    for _ in range(number):
+        gm.select_parents(population, MODE, scores)
+    return time.perf_counter() - start, size, 'individuals'
+
+
+def bench_select_parent_pairs(size, selection, number=1):
+    gm = make_music()
+    gm.selection = selection
+    scores = gm.fitness_batch(make_population(gm, size), MODE)
+    start = time.perf_counter()
+    for _ in range(number):
+        gm.select_parent_pairs(scores, size)
+    return time.perf_counter() - start, size, 'individuals'
+
+
+# Children bred from an initial population, which is full of duplicates;
+# they are restored before every call, as replace_duplicates removes them
+def bench_replace_duplicates(size, number=1):
+    gm = make_music()
+    population = genetic_ching4.MotifPopulation(make_population(gm, size))
+    scores = gm.fitness_batch(population.motifs, MODE)
+    children = genetic_ching4.MotifPopulation.empty(size, population.motifs.shape[1])
+    gm.generate_next_generation_batch(population, scores, MODE, 1, 10, 0.3, children)
+    bred = children.motifs.copy()
+    start = time.perf_counter()
+    for _ in range(number):
+        np.copyto(children.motifs, bred)
+        gm.replace_duplicates(population, scores, MODE, 1, 10, 0.3, children)
+    return time.perf_counter() - start, size, 'individuals'
+
+
+def bench_crossover(size, motif_length, number=1):
+    gm = make_music(motif_length)
+    population = make_population(gm, size)
+    start = time.perf_counter()
+    for _ in range(number):
+        for i in range(size):
+            gm.crossover(population[i], population[i - 1], MODE)
+    return time.perf_counter() - start, size, 'individuals'
+
+
+def bench_mutate(size, motif_length, number=1):
+    gm = make_music(motif_length)
+    population = make_population(gm, size)
+    start = time.perf_counter()
+    for _ in range(number):
+        for motif in population:
+            gm.mutate(motif, MODE, 1, 10, 0.3)
+    return time.perf_counter() - start, size, 'individuals'
+
+
+def bench_generate_next_generation(size, motif_length, number=1):
+    gm = make_music(motif_length)
+    population = make_population(gm, size)
+    scores = gm.fitness_batch(population, MODE)
+    start = time.perf_counter()
+    for _ in range(number):
+        gm.generate_next_generation(population, MODE, 1, 10, 0.3, scores)
+    return time.perf_counter() - start, size, 'individuals'
+
+
+def bench_generate_next_generation_batch(size, motif_length, number=1):
+    gm = make_music(motif_length)
+    population = MotifPopulation(make_population(gm, size))
+    spare = MotifPopulation.empty(*population.motifs.shape)
+    scores = gm.fitness_batch(population.motifs, MODE)
+    start = time.perf_counter()
+    for _ in range(number):
+        gm.generate_next_generation_batch(population, scores, MODE, 1, 10, 0.3, spare)
+    return time.perf_counter() - start, size, 'individuals'
+
+
+def bench_run_genetic_algorithm(size, generations, number=1):
+    gm = GeneticMusic(HEXAGRAM, 4, 0.3, seed=SEED)
+    start = time.perf_counter()
+    for _ in range(number):
+        gm.run_genetic_algorithm(generations, size, MODE, 0.3)
+    return time.perf_counter() - start, generations, 'generations'
+
+
+def bench_hexagram_to_music(size, number=1):
+    gm = GeneticMusic(HEXAGRAM, 4, 0.3, seed=SEED)
+    population = make_population(gm, size)
+    start = time.perf_counter()
+    for _ in range(number):
+        for motif in population:
+            gm.hexagram_to_music(motif, MODE, 0.8)
+    return time.perf_counter() - start, size, 'motifs'
+
+
+def bench_render_events(size, number=1):
+    gm = GeneticMusic(HEXAGRAM, 4, 0.3, seed=SEED)
+    population = make_population(gm, size)
+    start = time.perf_counter()
+    for _ in range(number):
+        gm.render_events(population, MODE, 0.8)
+    return time.perf_counter() - start, size, 'motifs'
+
+
+def bench_save_as_midi(size, backend, number=1):
+    gm = GeneticMusic(HEXAGRAM, 4, 0.3, seed=SEED)
+    sequences = [gm.hexagram_to_music(motif, MODE, 0.8)
+                 for motif in make_population(gm, size)]
+    workdir = tempfile.mkdtemp(dir=MIDI_WORKDIR)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            for i, music_sequences in enumerate(sequences):
+                gm.save_as_midi(music_sequences, id=i, backend=backend)
+        elapsed = time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    return elapsed, size, 'files'
+
+
+def bench_startup(target, number=1):
+    if target == 'import':
+        command = [sys.executable, '-c', 'import genetic_ching4']
+    else:
+        command = [sys.executable, os.path.join(PACKAGE_DIR, 'genetic_ching4.py')] + STARTUP_ARGS
+    env = dict(os.environ, PYTHONPATH=PACKAGE_DIR)
+    workdir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            subprocess.run(command, cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir)
+    return elapsed, 1, 'starts'
+
+
+# Cold start cases slower than STARTUP_BUDGET, as (params, seconds)
+def startup_over_budget(results, budget=STARTUP_BUDGET):
+    return [(result['params'], result['seconds']) for result in results
+            if result['name'] == 'startup' and result['params']['target'] == 'cli'
+            and result['seconds'] > budget]
+
+
+# Scores whose direct MIDI bytes differ from what music21 writes, as
+# (label, part count). Covers seeded renders of a few hexagrams, 64 among
+# them for its all-rest parts, plus a hand built score with an all-rest part
+def midi_mismatches():
+    scores = []
+    for hexagram in (1, 2, 20, 64):
+        gm = GeneticMusic(hexagram, 4, 0.3, seed=SEED)
+        for index, motif in enumerate(gm.generate_initial_population(3, 2)):
+            scores.append((f"hexagram {hexagram} motif {index}",
+                           gm.hexagram_to_music(motif, MODE, 0.6)))
+    scores.append(("all-rest part", [[(None, 4, None)] * 6,
+                                     [(60, 4, 90), (None, 2, None)],
+                                     [(None, 1, None)]]))
+    mismatches = []
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'check.mid')
+        for label, music in scores:
+            genetic_ching4.music21_score(music).write('midi', fp=path)
+            with open(path, 'rb') as f:
+                if f.read() != genetic_ching4.encode_midi(music):
+                    mismatches.append((label, len(music)))
+    finally:
+        shutil.rmtree(workdir)
+    return mismatches
+
+
+# (name, function, parameter sets) for the chosen grid
+def build_cases(grid):
+    sizes = grid['population_sizes']
+    lengths = grid['motif_lengths']
+    scalar_sizes = [size for size in sizes if size <= SCALAR_LIMIT]
+    cases = [('startup', bench_startup, {'target': 'import'}),
+             ('startup', bench_startup, {'target': 'cli'})]
+    for size in scalar_sizes:
+        for length in lengths:
+            params = {'size': size, 'motif_length': length}
+            cases += [
+                ('fitness_function', bench_fitness_function, params),
+                ('select_parents', bench_select_parents, params),
+                ('crossover', bench_crossover, params),
+                ('mutate', bench_mutate, params),
+                ('generate_next_generation', bench_generate_next_generation, params),
+            ]
+    for size in sizes:
+        for length in lengths:
+            params = {'size': size, 'motif_length': length}
+            cases += [
+                ('fitness_batch', bench_fitness_batch, params),
+                ('generate_next_generation_batch', bench_generate_next_generation_batch, params),
+            ]
+        for selection in genetic_ching4.SELECTION_STRATEGIES:
+            cases.append(('select_parent_pairs', bench_select_parent_pairs,
+                          {'size': size, 'selection': selection}))
+        cases.append(('replace_duplicates', bench_replace_duplicates, {'size': size}))
+        for generations in grid['generations']:
+            cases.append(('run_genetic_algorithm', bench_run_genetic_algorithm,
+                          {'size': size, 'generations': generations}))
+    for size in sizes:
+        cases.append(('render_events', bench_render_events, {'size': size}))
+    render_sizes = [size for size in scalar_sizes if size <= 1000]
+    for size in render_sizes:
+        cases.append(('hexagram_to_music', bench_hexagram_to_music, {'size': size}))
+        cases.append(('save_as_midi', bench_save_as_midi, {'size': size, 'backend': 'direct'}))
+        if genetic_ching4.music21_available():
+            cases.append(('save_as_midi', bench_save_as_midi, {'size': size, 'backend': 'music21'}))
+    return cases
+
+
+# Fastest seconds per call of one case, as (seconds, calls per sample,
+# count, unit). As in timeit.Timer.autorange, the calls per sample grow
+# 1, 2, 5, 10, 20, ... until a sample takes SAMPLE_TIME. Then samples are
+# taken until CASE_TIME is spent, at least `repeat` of them. Background load
+# here comes in bursts, so the minimum over many short samples is far
+# steadier than a few long runs.
+def time_case(function, params, repeat=3):
+    number, step = 1, 0
+    while True:
+        seconds, count, unit = function(number=number, **params)
+        if seconds >= SAMPLE_TIME:
+            break
+        step += 1
+        number = (1, 2, 5)[step % 3] * 10 ** (step // 3)
+    samples = [seconds]
+    while len(samples) < repeat or sum(samples) < CASE_TIME:
+        samples.append(function(number=number, **params)[0])
+    return min(samples) / number, number, count, unit
+
+
+# Minimum timed samples of a case: a cold start is a single slow call, so
+# the startup cases always take the best of STARTUP_RUNS
+def case_samples(name, repeat):
+    return max(repeat, STARTUP_RUNS) if name == 'startup' else repeat
+
+
+# Times every case and keeps its fastest time per call
+def run_cases(cases, repeat=3, only=None):
+    results = []
+    for name, function, params in cases:
+        if only and name not in only:
+            continue
+        result = {'name': name, 'params': params}
+        set_timing(result, *time_case(function, params, case_samples(name, repeat)))
+        result['peak_memory_kb'] = peak_memory_kb(function, params)
+        unit = result['unit']
+        print(f"{name:32s} {json.dumps(params):48s} {result['rate']:14.1f} {unit}/s", flush=True)
+        results.append(result)
+    return results
+
+
+# Stores a time_case timing in a result
+def set_timing(result, seconds, number, count, unit):
+    result.update(seconds=seconds, number=number, count=count, unit=unit,
+                  rate=count / seconds if seconds > 0 else float('inf'))
+    if unit == 'generations':
+        # Every generation scores the whole population once
+        result['individuals_per_second'] = result['rate'] * result['params']['size']
+
+
+def case_key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+# compare, after timing the cases that look slower than the baseline again
+# (up to `retries` times a second apart, keeping their fastest time). On
+# shared machines the CPU drops to about half speed for seconds at a time,
+# which a single timing of a case cannot tell from a regression.
+def confirm_regressions(cases, results, baseline, tolerance, repeat=3, retries=5):
+    functions = {case_key({'name': name, 'params': params}): function
+                 for name, function, params in cases}
+    regressions = compare(results, baseline, tolerance)
+    for _ in range(retries):
+        if not regressions:
+            break
+        time.sleep(1)
+        slow = {key for key, _, _, _ in regressions}
+        for result in results:
+            if case_key(result) in slow:
+                timing = time_case(functions[case_key(result)], result['params'],
+                                   case_samples(result['name'], repeat))
+                if timing[0] < result['seconds']:
+                    set_timing(result, *timing)
+        regressions = compare(results, baseline, tolerance)
+    return regressions
+
+
+# Returns (case, baseline rate, current rate, ratio) for every case slower
+# than the baseline by more than `tolerance`
+def compare(results, baseline, tolerance):
+    previous = {case_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get(case_key(result))
+        if before is None or not before['rate']:
+            continue
+        ratio = result['rate'] / before['rate']
+        if ratio < 1 - tolerance:
+            regressions.append((case_key(result), before['rate'], result['rate'], ratio))
+    return regressions
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': SEED,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the Genetic Music Algorithm')
+    parser.add_argument('--quick', action='store_true',
+                        help='Use a small grid for a fast smoke run')
+    parser.add_argument('--only', type=str, default=None,
+                        help='Comma separated benchmark names to run')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Minimum timed samples per case; the fastest is kept')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Save results as JSON to this file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown against the baseline (0.2 = 20%%)')
+    parser.add_argument('--startup_budget', type=float, default=STARTUP_BUDGET,
+                        help='Maximum seconds for a cold command line run')
+
+    args = parser.parse_args()
+    grid = QUICK_GRID if args.quick else FULL_GRID
+    only = set(args.only.split(',')) if args.only else None
+    cases = build_cases(grid)
+    results = run_cases(cases, args.repeat, only)
+
+    failed = False
+    for params, seconds in startup_over_budget(results, args.startup_budget):
+        print(f"OVER BUDGET startup {json.dumps(params)}: {seconds:.3f}s > {args.startup_budget:.3f}s")
+        failed = True
+    if genetic_ching4.music21_available():
+        for label, parts in midi_mismatches():
+            print(f"MIDI MISMATCH {label} ({parts} parts): direct bytes differ from music21")
+            failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = confirm_regressions(cases, results, baseline, args.tolerance, args.repeat)
+        for (name, params), before, after, ratio in regressions:
+            print(f"REGRESSION {name} {params}: {before:.1f} -> {after:.1f} ({ratio:.2f}x)")
+        failed = failed or bool(regressions)
+    if args.output:
+        report = {'environment': environment(), 'grid': grid, 'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,250 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import time
+
+import numpy as np
+
+from genetic_ching4 import GeneticMusic, EvolutionResult, RenderPipeline, population_diversity
+
+
+# Island model: several sub-populations evolve in parallel processes with the
+# usual select_parents/crossover/mutate operators and every
+# `migration_interval` generations send copies of their best motifs to their
+# neighbours. Migrants travel as raw int16 bytes, not pickled lists.
+
+MIGRANT_DTYPE = np.int16
+
+
+# Islands that receive migrants from `island` under the given topology
+def migration_targets(island, islands, topology):
+    if islands < 2:
+        return []
+    if topology == 'ring':
+        return [(island + 1) % islands]
+    if topology == 'full':
+        return [other for other in range(islands) if other != island]
+    raise ValueError(f"unknown topology: {topology}")
+
+
+def pack_motifs(motifs):
+    return np.asarray(motifs, dtype=MIGRANT_DTYPE).tobytes()
+
+
+def unpack_motifs(data, motif_length):
+    return np.frombuffer(data, dtype=MIGRANT_DTYPE).reshape(-1, motif_length)
+
+
+# Process entry point: puts the island's report on `results`, or an error
+# record ({'island', 'error'}) when it fails, so the parent never waits
+# for a report that will not come
+def island_worker(island, params, inboxes, results, seed):
+    try:
+        results.put(run_island(island, params, inboxes, seed))
+    except Exception as error:
+        results.put({'island': island, 'error': f"{type(error).__name__}: {error}"})
+
+
+def run_island(island, params, inboxes, seed):
+    islands = len(inboxes)
+    mode = params['mode']
+    generations = params['generations']
+    interval = params['migration_interval']
+    targets = migration_targets(island, islands, params['topology'])
+    sources = sum(island in migration_targets(other, islands, params['topology'])
+                  for other in range(islands))
+
+    gm = GeneticMusic(params['hexagram'], params['base_duration'],
+                      params['harmonicity_ratio'], seed=seed,
+                      dedupe=params['dedupe'], crowding=params['crowding'])
+    motif_length = len(gm.initial_hexagram)
+    population = gm.generate_initial_population(params['population'], mode)
+    scores = gm.fitness_batch(population, mode)
+    evaluations = len(population)
+    migration_seconds = 0.0
+    start = time.perf_counter()
+
+    for generation in range(generations):
+        order = np.argsort(-scores, kind='stable')
+        population = [population[i] for i in order]
+        scores = scores[order]
+        population = gm.generate_next_generation(
+            population, mode, generation, generations, params['mutation_rate'], scores)
+        scores = gm.fitness_batch(population, mode)
+        evaluations += len(population)
+
+        if targets or sources:
+            if (generation + 1) % interval == 0 and generation + 1 < generations:
+                migration_start = time.perf_counter()
+                best = np.argsort(-scores, kind='stable')[:params['migrants']]
+                message = pack_motifs([population[i] for i in best])
+                for target in targets:
+                    inboxes[target].put(message)
+
+                # Incoming migrants replace the worst individuals
+                incoming = np.concatenate(
+                    [unpack_motifs(inboxes[island].get(), motif_length)
+                     for _ in range(sources)])
+                worst = np.argsort(scores, kind='stable')[:len(incoming)]
+                for i, motif in zip(worst.tolist(), incoming.tolist()):
+                    population[i] = motif
+                scores[worst] = gm.fitness_batch(incoming, mode)
+                evaluations += len(incoming)
+                migration_seconds += time.perf_counter() - migration_start
+
+    elapsed = time.perf_counter() - start
+    return {
+        'island': island,
+        'population': pack_motifs(population),
+        'scores': scores.tobytes(),
+        'generations': generations,
+        'evaluations': evaluations,
+        'seconds': elapsed,
+        'migration_seconds': migration_seconds,
+        'generations_per_second': generations / elapsed if elapsed else 0.0,
+        'evaluations_per_second': evaluations / elapsed if elapsed else 0.0,
+        'best_score': float(scores.max()),
+        'diversity': population_diversity(population),
+    }
+
+
+# Runs the islands and returns the merged final populations as an
+# EvolutionResult (best first) together with one throughput report per island
+def run_islands(hexagram, mode, islands=4, population_size=100, generations=100,
+                mutation_rate=0.3, harmonicity_ratio=0.3, base_duration=4,
+                migration_interval=10, migrants=2, topology='ring', seed=None,
+                dedupe=False, crowding=0):
+    params = {
+        'hexagram': hexagram,
+        'mode': mode,
+        'population': population_size,
+        'generations': generations,
+        'mutation_rate': mutation_rate,
+        'harmonicity_ratio': harmonicity_ratio,
+        'base_duration': base_duration,
+        'migration_interval': migration_interval,
+        'migrants': migrants,
+        'topology': topology,
+        'dedupe': dedupe,
+        'crowding': crowding,
+    }
+    # Parameters a worker would only reject after the others started waiting
+    sources = len(migration_targets(0, islands, topology))  # both topologies are symmetric
+    if population_size < 4:
+        raise ValueError("population must have at least 4 individuals per island")
+    # Migrants from every source replace an island's worst individuals, and
+    # at least one of its own must survive
+    if migrants * sources >= population_size:
+        raise ValueError(f"{migrants} migrants from each of {sources} islands would replace "
+                         f"the whole population of {population_size}; use fewer migrants or "
+                         f"islands, or a larger population")
+    if migration_interval < 1:
+        raise ValueError("migration_interval must be at least 1")
+    # Each island seeds its Generator with its own spawned SeedSequence
+    seeds = np.random.SeedSequence(seed).spawn(islands)
+    inboxes = [multiprocessing.Queue() for _ in range(islands)]
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=island_worker,
+                                       args=(island, params, inboxes, results, seeds[island]))
+               for island in range(islands)]
+    for worker in workers:
+        worker.start()
+    # A failed island reports an error; one that died without reporting is
+    # noticed by its exit code. Either way the rest, possibly blocked waiting
+    # for migrants, are terminated.
+    reports = []
+    try:
+        while len(reports) < islands:
+            try:
+                report = results.get(timeout=0.5)
+            except queue.Empty:
+                for worker in workers:
+                    if worker.exitcode not in (None, 0):
+                        raise RuntimeError(f"island process exited with code {worker.exitcode}")
+                continue
+            if 'error' in report:
+                raise RuntimeError(f"island {report['island']} failed: {report['error']}")
+            reports.append(report)
+    finally:
+        if len(reports) < islands:
+            for worker in workers:
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+
+    reports.sort(key=lambda report: report['island'])
+    motif_length = len(GeneticMusic(hexagram, base_duration, harmonicity_ratio).initial_hexagram)
+    population = np.concatenate(
+        [unpack_motifs(report.pop('population'), motif_length) for report in reports])
+    scores = np.concatenate(
+        [np.frombuffer(report.pop('scores'), dtype=np.float64) for report in reports])
+    order = np.argsort(-scores, kind='stable')
+    return EvolutionResult(population[order].tolist(), scores[order], []), reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the Genetic Music Algorithm as an island model')
+    parser.add_argument('--generations', type=int,
+                        required=True, help='Number of generations to run')
+    parser.add_argument('--population', type=int,
+                        required=True, help='Size of each island population')
+    parser.add_argument('--hexagram', type=int, nargs='+', required=True,
+                        choices=range(1, 65),
+                        help='Hexagram number (1-64), or several for a long-form phrase')
+    parser.add_argument('--mode', type=int, default=None, choices=range(1, 7),
+                        help='Mode (1-6), random when omitted')
+    parser.add_argument('--base_duration', type=int, default=4,
+                        help='Base duration for notes')
+    parser.add_argument('--mutation_rate', type=float, default=0.3,
+                        help='Mutation rate for genetic algorithm')
+    parser.add_argument('--harmonicity_ratio', type=float, default=0.3,
+                        help='Harmonicity ratio from 0 to 1')
+    parser.add_argument('--dynamic_ratio', type=float, default=0.8,
+                        help='Dynamic ratio for high and low dynamics')
+    parser.add_argument('--islands', type=int, default=os.cpu_count(),
+                        help='Number of islands (one process each)')
+    parser.add_argument('--migration_interval', type=int, default=10,
+                        help='Generations between migrations')
+    parser.add_argument('--migrants', type=int, default=2,
+                        help='Best motifs each island sends per migration')
+    parser.add_argument('--topology', choices=['ring', 'full'], default='ring',
+                        help='Which islands exchange migrants')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for the island random streams')
+    parser.add_argument('--render', type=int, default=0,
+                        help='Write MIDI files for this many of the best motifs')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='Replace children that duplicate another child of the generation')
+    parser.add_argument('--crowding', type=int, default=0,
+                        help='Crowding window: each child competes with the nearest of this '
+                             'many random parents (0 disables)')
+
+    args = parser.parse_args()
+    mode = args.mode if args.mode is not None else int(np.random.default_rng(args.seed).integers(1, 7))
+    result, reports = run_islands(args.hexagram, mode, args.islands, args.population,
+                                  args.generations, args.mutation_rate, args.harmonicity_ratio,
+                                  args.base_duration, args.migration_interval, args.migrants,
+                                  args.topology, args.seed, args.dedupe, args.crowding)
+    for report in reports:
+        print(json.dumps(report))
+    best_motif, best_score = result.best()
+    print(json.dumps({'mode': mode, 'best_motif': best_motif, 'best_score': best_score}))
+
+    if args.render:
+        gm = GeneticMusic(args.hexagram, args.base_duration, args.harmonicity_ratio,
+                          seed=args.seed)
+        label = f"island_h{'-'.join(f'{n:02d}' for n in args.hexagram)}_m{mode}"
+        manifest = {'hexagram': args.hexagram, 'mode': mode,
+                    'params': {'generations': args.generations, 'population': args.population,
+                               'islands': args.islands, 'mutation_rate': args.mutation_rate,
+                               'harmonicity_ratio': args.harmonicity_ratio,
+                               'dynamic_ratio': args.dynamic_ratio, 'seed': args.seed}}
+        events = gm.render_events(np.asarray(result.population)[:args.render], mode,
+                                  args.dynamic_ratio)
+        with RenderPipeline(0, manifest=manifest, verbose=False) as pipeline:
+            for i, motif in enumerate(result.population[:args.render]):
+                entry = {'hexagram': args.hexagram, 'mode': mode, 'motif': motif,
+                         'fitness': float(result.scores[i])}
+                pipeline.submit(gm, events.music_sequences(i), entry, id=i, label=label)
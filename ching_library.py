@@ -0,0 +1,152 @@
+import argparse
+import json
+import sqlite3
+from datetime import datetime
+
+
+# Persistent motif library: an SQLite file recording every motif a run kept,
+# with the hexagram sequence, mode, fitness and run parameters that produced
+# it, and the MIDI files rendered from it. A motif is stored once per
+# (hexagram, mode) under its canonical form, the compact JSON list of its
+# pitches with rests as -1, so repeated runs only add render rows.
+#
+#   python3 ching_library.py library.db --hexagram 20 --mode 2 --top 10
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS motifs (
+    id INTEGER PRIMARY KEY,
+    motif TEXT NOT NULL,
+    hexagram TEXT NOT NULL,
+    mode INTEGER NOT NULL,
+    fitness REAL NOT NULL,
+    params TEXT NOT NULL,
+    created TEXT NOT NULL,
+    UNIQUE (motif, hexagram, mode)
+);
+CREATE INDEX IF NOT EXISTS motifs_ranking ON motifs (hexagram, mode, fitness DESC, id);
+CREATE TABLE IF NOT EXISTS renders (
+    motif_id INTEGER NOT NULL REFERENCES motifs (id),
+    path TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS renders_motif ON renders (motif_id);
+'''
+
+
+def canonical_motif(motif):
+    return json.dumps([int(note) for note in motif], separators=(',', ':'))
+
+
+# Hexagram sequences are keyed as space separated numbers, "20" or "20 8"
+def hexagram_key(hexagram):
+    if isinstance(hexagram, int):
+        return str(hexagram)
+    return ' '.join(str(int(number)) for number in hexagram)
+
+
+class MotifLibrary:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    # Stores motifs with their fitness scores and returns their row ids,
+    # aligned with `motifs`. Motifs already in the library keep their
+    # original row (fitness depends only on motif, hexagram and mode).
+    def add_many(self, motifs, scores, hexagram, mode, params=None):
+        key = hexagram_key(hexagram)
+        params = json.dumps(params or {}, sort_keys=True)
+        created = datetime.now().isoformat(timespec='seconds')
+        canonical = [canonical_motif(motif) for motif in motifs]
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO motifs (motif, hexagram, mode, fitness, params, created) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(motif, key, int(mode), float(score), params, created)
+                 for motif, score in zip(canonical, scores)])
+            ids = {}
+            for motif in set(canonical):
+                row = self.connection.execute(
+                    'SELECT id FROM motifs WHERE motif = ? AND hexagram = ? AND mode = ?',
+                    (motif, key, int(mode))).fetchone()
+                ids[motif] = row['id']
+        return [ids[motif] for motif in canonical]
+
+    def add(self, motif, score, hexagram, mode, params=None):
+        return self.add_many([motif], [score], hexagram, mode, params)[0]
+
+    # Records the MIDI file rendered from each motif id; None paths (files
+    # that failed to write) are skipped
+    def add_renders(self, motif_ids, paths):
+        created = datetime.now().isoformat(timespec='seconds')
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO renders (motif_id, path, created) VALUES (?, ?, ?)',
+                [(motif_id, path, created)
+                 for motif_id, path in zip(motif_ids, paths) if path is not None])
+
+    # The n fittest motifs for a hexagram (or sequence) and mode, best first
+    # and oldest first among ties, as dicts with the decoded motif
+    def top(self, hexagram, mode, n=10, min_fitness=None):
+        query = 'SELECT * FROM motifs WHERE hexagram = ? AND mode = ?'
+        arguments = [hexagram_key(hexagram), int(mode)]
+        if min_fitness is not None:
+            query += ' AND fitness >= ?'
+            arguments.append(min_fitness)
+        query += ' ORDER BY fitness DESC, id LIMIT ?'
+        arguments.append(n)
+        return [self.decode(row) for row in self.connection.execute(query, arguments)]
+
+    def renders(self, motif_id):
+        rows = self.connection.execute(
+            'SELECT path FROM renders WHERE motif_id = ? ORDER BY rowid', (motif_id,))
+        return [row['path'] for row in rows]
+
+    def count(self, hexagram=None, mode=None):
+        query = 'SELECT COUNT(*) FROM motifs'
+        conditions, arguments = [], []
+        if hexagram is not None:
+            conditions.append('hexagram = ?')
+            arguments.append(hexagram_key(hexagram))
+        if mode is not None:
+            conditions.append('mode = ?')
+            arguments.append(int(mode))
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        return self.connection.execute(query, arguments).fetchone()[0]
+
+    def decode(self, row):
+        entry = dict(row)
+        entry['motif'] = json.loads(entry['motif'])
+        entry['hexagram'] = [int(number) for number in entry['hexagram'].split()]
+        entry['params'] = json.loads(entry['params'])
+        return entry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query the motif library')
+    parser.add_argument('library', type=str, help='Library file (SQLite)')
+    parser.add_argument('--hexagram', type=int, nargs='+', required=True,
+                        choices=range(1, 65), help='Hexagram number (1-64), or a sequence')
+    parser.add_argument('--mode', type=int, required=True, choices=range(1, 7),
+                        help='Mode (1-6)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of motifs to list')
+    parser.add_argument('--min_fitness', type=float, default=None,
+                        help='Only list motifs at least this fit')
+
+    args = parser.parse_args()
+    with MotifLibrary(args.library) as library:
+        for entry in library.top(args.hexagram, args.mode, args.top, args.min_fitness):
+            entry['renders'] = library.renders(entry['id'])
+            print(json.dumps(entry))
@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+
+from ching_stream import NoteStreamer
+from genetic_ching4 import GeneticMusic, FitnessCache, build_parser, run_from_args
+
+
+# Long-running generator: keeps the interpreter, NumPy, music21 (once a request
+# has used the music21 backend) and GeneticMusic instances warm and answers
+# generate requests sent over a local socket.
+#
+# Protocol: one JSON object per line, using the same names as the
+# genetic_ching4.py command line options, e.g.
+#   {"generations": 100, "population": 10, "hexagram": 20, "base_duration": 4,
+#    "mutation_rate": 0.3, "harmonicity_ratio": 0.3, "dynamic_ratio": 0.8}
+# Each request gets one JSON line back:
+#   {"ok": true, "paths": ["/abs/path/midi_generation/...mid", ...]}
+#   {"ok": false, "error": "..."}
+class GeneratorService:
+    # streams: --stream destinations whose streamers are started up front,
+    # so that not even the first request waits for one
+    def __init__(self, cache_size=0, max_pending=64, streams=()):
+        self.parser = build_parser()
+        # Shared by every warm instance, so scores carry over between requests
+        # (off unless --cache_size is set)
+        self.fitness_cache = FitnessCache(cache_size) if cache_size > 0 else None
+        self.instances = {}
+        # One long-lived NoteStreamer per --stream destination: spawning its
+        # process takes a few hundred milliseconds, far more than the
+        # latency a streamed motif should have
+        self.streamers = {stream: NoteStreamer(stream) for stream in streams}
+        # Requests are handled one at a time in arrival order; a burst of
+        # generate messages waits here instead of starting parallel work.
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.worker = threading.Thread(target=self.process_jobs, daemon=True)
+        self.worker.start()
+
+    # Turns a JSON request into argv for the regular command line parser
+    def parse_request(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        argv = []
+        for key, value in request.items():
+            # Flags such as "resume" or "from_library" are JSON booleans
+            if isinstance(value, bool):
+                argv += [f"--{key}"] if value else []
+                continue
+            values = value if isinstance(value, list) else [value]
+            argv += [f"--{key}"] + [str(v) for v in values]
+        try:
+            return self.parser.parse_args(argv)
+        except SystemExit:
+            raise ValueError(f"invalid request: {json.dumps(request)}")
+
+    def instance_for(self, args):
+        key = (tuple(args.hexagram), args.base_duration, args.harmonicity_ratio)
+        gm = self.instances.get(key)
+        if gm is None:
+            gm = GeneticMusic(args.hexagram, args.base_duration, args.harmonicity_ratio,
+                              fitness_cache=self.fitness_cache, cache_size=0)
+            self.instances[key] = gm
+        return gm
+
+    # The running streamer for the request's --stream destination, if any
+    def streamer_for(self, args):
+        if not args.stream:
+            return None
+        streamer = self.streamers.get(args.stream)
+        if streamer is None or not streamer.alive():
+            streamer = NoteStreamer(args.stream)
+            self.streamers[args.stream] = streamer
+        return streamer
+
+    def generate(self, request):
+        args = self.parse_request(request)
+        paths = run_from_args(args, gm=self.instance_for(args), streamer=self.streamer_for(args))
+        return [os.path.abspath(path) for path in paths]
+
+    # Stops the streamers at once; queued motifs are not played
+    def close(self):
+        for streamer in self.streamers.values():
+            streamer.close(wait=False)
+        self.streamers.clear()
+
+    def process_jobs(self):
+        while True:
+            request, reply = self.jobs.get()
+            try:
+                reply['paths'] = self.generate(request)
+            except Exception as error:
+                reply['error'] = str(error)
+            finally:
+                reply['done'].set()
+                self.jobs.task_done()
+
+    # Queues a request and blocks until the worker has finished it
+    def submit(self, request):
+        reply = {'done': threading.Event()}
+        self.jobs.put((request, reply))
+        reply['done'].wait()
+        if 'error' in reply:
+            return {'ok': False, 'error': reply['error']}
+        return {'ok': True, 'paths': reply['paths']}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                response = self.server.service.submit(json.loads(line))
+            except ValueError as error:
+                response = {'ok': False, 'error': str(error)}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+
+
+class TCPGeneratorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class UnixGeneratorServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(service, host='127.0.0.1', port=5757, unix_socket=None):
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = UnixGeneratorServer(unix_socket, RequestHandler)
+        address = unix_socket
+    else:
+        server = TCPGeneratorServer((host, port), RequestHandler)
+        address = f"{host}:{server.server_address[1]}"
+    server.service = service
+    print(f"Generator server listening on {address}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+
+
+# Sends one request to a running server and returns the decoded reply
+def request_generation(request, host='127.0.0.1', port=5757, unix_socket=None, timeout=None):
+    if unix_socket is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        connection.connect(unix_socket)
+    else:
+        connection = socket.create_connection((host, port), timeout=timeout)
+    with connection, connection.makefile('rwb') as stream:
+        stream.write((json.dumps(request) + "\n").encode())
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the Genetic Music generator as a local server')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Address to listen on (localhost only by default)')
+    parser.add_argument('--port', type=int, default=5757,
+                        help='TCP port to listen on')
+    parser.add_argument('--unix_socket', type=str, default=None,
+                        help='Listen on this Unix domain socket instead of TCP')
+    parser.add_argument('--cache_size', type=int, default=0,
+                        help='Size of the fitness cache shared by all requests (0 disables it)')
+    parser.add_argument('--max_pending', type=int, default=64,
+                        help='Maximum number of queued generate requests')
+    parser.add_argument('--stream', type=str, nargs='*', default=[],
+                        help='Start note streamers for these destinations '
+                             '(e.g. udp://127.0.0.1:9000) before the first request')
+
+    args = parser.parse_args()
+    serve(GeneratorService(args.cache_size, args.max_pending, args.stream),
+          args.host, args.port, args.unix_socket)
@@ -0,0 +1,285 @@
+import argparse
+import multiprocessing
+import queue
+import socket
+import struct
+import time
+
+
+# Real-time output backend: instead of writing MIDI files for Max to find and
+# load, motifs are played as OSC note events over UDP (Max reads them with
+# [udpreceive]). Every event of every part is merged into one timeline and
+# sent by a scheduling loop in its own process that sleeps until just before
+# each event and spins for the rest. Jitter stays within the operating
+# system's sleep accuracy (well under a millisecond on an idle desktop, a
+# few milliseconds on a loaded single core), whatever the GA is doing.
+#
+# Messages:
+#   /ching/motif    id parts
+#   /ching/note_on  part pitch velocity
+#   /ching/note_off part pitch
+#
+#   python3 ching_stream.py --port 9000     # print what a receiver would get
+
+ADDRESS_MOTIF = '/ching/motif'
+ADDRESS_NOTE_ON = '/ching/note_on'
+ADDRESS_NOTE_OFF = '/ching/note_off'
+
+# Seconds before an event at which the loop stops sleeping and spins
+SPIN_SECONDS = 0.002
+# Delay between receiving a motif and its first event, so the first sends
+# are not already late
+START_DELAY = 0.005
+# Job asking the scheduling loop to report the send timing so far
+DRAIN = 'drain'
+
+
+def osc_string(value):
+    data = value.encode() + b'\0'
+    return data + b'\0' * (-len(data) % 4)
+
+
+def osc_message(address, *args):
+    tags = ','
+    payload = b''
+    for arg in args:
+        if isinstance(arg, int):
+            tags += 'i'
+            payload += struct.pack('>i', arg)
+        elif isinstance(arg, float):
+            tags += 'f'
+            payload += struct.pack('>f', arg)
+        else:
+            tags += 's'
+            payload += osc_string(str(arg))
+    return osc_string(address) + osc_string(tags) + payload
+
+
+def read_osc_string(data, offset):
+    end = data.index(b'\0', offset)
+    return data[offset:end].decode(), end + 1 + (-(end + 1) % 4)
+
+
+# (address, args) of one OSC message
+def parse_osc_message(data):
+    address, offset = read_osc_string(data, 0)
+    tags, offset = read_osc_string(data, offset)
+    args = []
+    for tag in tags[1:]:
+        if tag == 'i':
+            args.append(struct.unpack_from('>i', data, offset)[0])
+            offset += 4
+        elif tag == 'f':
+            args.append(struct.unpack_from('>f', data, offset)[0])
+            offset += 4
+        elif tag == 's':
+            value, offset = read_osc_string(data, offset)
+            args.append(value)
+        else:
+            raise ValueError(f"unsupported OSC type tag: {tag}")
+    return address, args
+
+
+# Timeline of one motif: (seconds from start, order, address, args) for the
+# note-on and note-off of every note in every part, sorted by time. The
+# timing follows the (pitch, quarter length, velocity) tuples from
+# hexagram_to_music, rests only advance their part's clock. At equal times
+# note-offs go before note-ons.
+def schedule_events(music_sequences, tempo_bpm=120):
+    seconds_per_quarter = 60.0 / tempo_bpm
+    events = []
+    for part, sequence in enumerate(music_sequences, start=1):
+        onset = 0.0
+        for pitch, duration, velocity in sequence:
+            length = duration * seconds_per_quarter
+            if pitch is not None:
+                events.append((onset, 1, ADDRESS_NOTE_ON, (part, int(pitch), int(velocity))))
+                events.append((onset + length, 0, ADDRESS_NOTE_OFF, (part, int(pitch))))
+            onset += length
+    events.sort(key=lambda event: (event[0], event[1]))
+    return events
+
+
+# Sleeps until shortly before `target` (a perf_counter time), then spins
+def wait_until(target):
+    remaining = target - time.perf_counter()
+    if remaining > SPIN_SECONDS:
+        time.sleep(remaining - SPIN_SECONDS)
+    while time.perf_counter() < target:
+        pass
+
+
+# Scheduling loop of a NoteStreamer, run in its own process so that a busy
+# GA in the parent (holding the GIL) cannot hold up an event. Plays each
+# (motif id, music_sequences) job in real time until it gets None. The send
+# lateness in seconds of every event since the last report is put on
+# `results` for each DRAIN job and on exit.
+def stream_worker(destination, tempo_bpm, jobs, results):
+    connection = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    jitters = []
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            if job == DRAIN:
+                results.put(jitters)
+                jitters = []
+                continue
+            motif_id, music_sequences = job
+            # Everything is encoded up front so the loop only waits and sends
+            timeline = [(offset, osc_message(address, *args)) for offset, _, address, args
+                        in schedule_events(music_sequences, tempo_bpm)]
+            connection.sendto(osc_message(ADDRESS_MOTIF, motif_id, len(music_sequences)),
+                              destination)
+            start = time.perf_counter() + START_DELAY
+            for offset, message in timeline:
+                target = start + offset
+                wait_until(target)
+                connection.sendto(message, destination)
+                jitters.append(time.perf_counter() - target)
+    finally:
+        connection.close()
+        results.put(jitters)
+
+
+# Plays submitted motifs one after the other in a separate process, so the
+# caller (e.g. the GA) carries on while notes are sounding. The queue is
+# bounded; submit() blocks when `max_pending` motifs are waiting. The
+# process is spawned rather than forked: the generator server calls this
+# from a threaded process, where a forked child can inherit held locks.
+# The helper can then hang or die. Spawning costs a fresh interpreter and
+# NumPy import (a few hundred milliseconds), so a streamer should be
+# created before the motifs are ready and kept for as long as its
+# destination is in use: the generator server keeps one per destination
+# and only drain()s it between requests.
+class NoteStreamer:
+    def __init__(self, target, tempo_bpm=120, max_pending=16):
+        if target.startswith('udp://'):
+            target = target[len('udp://'):]
+        host, port = target.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.tempo_bpm = tempo_bpm
+        context = multiprocessing.get_context('spawn')
+        self.jobs = context.Queue(maxsize=max(max_pending, 1))
+        self.results = context.Queue()
+        self.submitted = 0
+        self.jitters = []
+        self.closed = False
+        self.process = context.Process(
+            target=stream_worker, args=(self.address, tempo_bpm, self.jobs, self.results),
+            daemon=True)
+        self.process.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(wait=exc_type is None)
+
+    # Queues a motif for playback. With block=False a motif that finds the
+    # queue full is dropped instead of holding up the caller; returns whether
+    # it was queued.
+    def submit(self, music_sequences, block=True):
+        try:
+            self.jobs.put((self.submitted, music_sequences), block=block)
+        except queue.Full:
+            return False
+        self.submitted += 1
+        return True
+
+    # Whether the scheduling process can still play motifs
+    def alive(self):
+        return not self.closed and self.process.is_alive()
+
+    # Waits for every queued motif to finish playing and keeps the streamer
+    # running; statistics() then covers the events since the last drain
+    def drain(self):
+        self.jobs.put(DRAIN)
+        self.jitters = self.report()
+
+    # The next timing report of the scheduling process. A process that died
+    # (e.g. failed to start) never reports.
+    def report(self):
+        while True:
+            try:
+                return self.results.get(timeout=0.1)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    return []
+
+    # Waits for every queued motif to finish playing, or with wait=False
+    # stops playback at once
+    def close(self, wait=True):
+        if self.closed:
+            return
+        self.closed = True
+        if wait:
+            self.jobs.put(None)
+            self.jitters = self.report()
+            self.process.join()
+        else:
+            self.process.terminate()
+            self.process.join()
+            # Nobody reads the motifs still queued; don't wait to flush them
+            self.jobs.cancel_join_thread()
+        for channel in (self.jobs, self.results):
+            channel.close()
+            channel.join_thread()
+
+    # Send timing: events sent, mean and worst lateness in seconds (known
+    # once the streamer has been drained or closed)
+    def statistics(self):
+        if not self.jitters:
+            return {'events': 0, 'mean_jitter': 0.0, 'max_jitter': 0.0}
+        return {'events': len(self.jitters),
+                'mean_jitter': sum(self.jitters) / len(self.jitters),
+                'max_jitter': max(self.jitters)}
+
+
+# Local stand-in for the Max patch: receives OSC note events and reports
+# them with their arrival time
+class NoteReceiver:
+    def __init__(self, host='127.0.0.1', port=9000):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.address = self.socket.getsockname()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Yields (arrival perf_counter time, address, args) until `timeout`
+    # seconds pass without a message (forever when timeout is None)
+    def receive(self, timeout=None):
+        self.socket.settimeout(timeout)
+        while True:
+            try:
+                data, _ = self.socket.recvfrom(65536)
+            except socket.timeout:
+                return
+            address, args = parse_osc_message(data)
+            yield time.perf_counter(), address, args
+
+    def close(self):
+        self.socket.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print the OSC note events sent by --stream')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Address to listen on')
+    parser.add_argument('--port', type=int, default=9000,
+                        help='UDP port to listen on')
+
+    args = parser.parse_args()
+    with NoteReceiver(args.host, args.port) as receiver:
+        print(f"Listening for note events on {args.host}:{receiver.address[1]}", flush=True)
+        started = None
+        for arrival, address, values in receiver.receive():
+            if address == ADDRESS_MOTIF:
+                started = arrival
+            offset = arrival - started if started is not None else 0.0
+            print(f"{offset:9.4f} {address} {' '.join(str(value) for value in values)}", flush=True)
@@ -0,0 +1,195 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from genetic_ching4 import GeneticMusic, FitnessCache, RenderPipeline
+
+
+# Catalogue sweep: every combination of hexagram, mode, mutation rate and
+# harmonicity ratio is an independent run_genetic_algorithm job spread over a
+# process pool. Results are streamed back as JSON lines as jobs finish.
+# With --render the final populations are written as MIDI files by a
+# RenderPipeline in the parent process while the workers keep evolving.
+
+# One fitness cache per worker process, shared by all jobs it runs
+_worker_cache = None
+
+
+def parse_int_list(text):
+    values = []
+    for part in text.split(','):
+        if '-' in part:
+            start, stop = part.split('-')
+            values += range(int(start), int(stop) + 1)
+        else:
+            values.append(int(part))
+    return values
+
+
+def parse_float_list(text):
+    return [float(value) for value in text.split(',')]
+
+
+# Expands the parameter grid into job dictionaries. Every job gets its own
+# SeedSequence spawned from one root, so workers draw from independent,
+# non-overlapping random streams and a sweep can be repeated exactly.
+# Rendering draws from a child of the job's sequence.
+def build_jobs(hexagrams, modes, mutation_rates, harmonicity_ratios,
+               generations, population_size, base_duration, dynamic_ratio,
+               seed=None, render=False, midi_backend='direct'):
+    grid = list(itertools.product(
+        hexagrams, modes, mutation_rates, harmonicity_ratios))
+    seeds = np.random.SeedSequence(seed).spawn(len(grid))
+    jobs = []
+    for job_id, ((hexagram, mode, mutation_rate, harmonicity_ratio), job_seed) in enumerate(zip(grid, seeds)):
+        jobs.append({
+            'job_id': job_id,
+            'hexagram': hexagram,
+            'mode': mode,
+            'mutation_rate': mutation_rate,
+            'harmonicity_ratio': harmonicity_ratio,
+            'generations': generations,
+            'population': population_size,
+            'base_duration': base_duration,
+            'dynamic_ratio': dynamic_ratio,
+            'seed': job_seed,
+            'render_seed': job_seed.spawn(1)[0],
+            'render': render,
+            'midi_backend': midi_backend,
+        })
+    return jobs
+
+
+# JSON form of a job's SeedSequence for reports and manifests;
+# SeedSequence(seed, spawn_key=spawn_key) rebuilds it
+def seed_fields(job):
+    return {'seed': job['seed'].entropy, 'spawn_key': list(job['seed'].spawn_key)}
+
+
+def init_worker(cache_size):
+    global _worker_cache
+    _worker_cache = FitnessCache(cache_size) if cache_size > 0 else None
+
+
+# Runs one grid point in a worker process
+def run_sweep_job(job):
+    gm = GeneticMusic(job['hexagram'], job['base_duration'], job['harmonicity_ratio'],
+                      fitness_cache=_worker_cache, cache_size=0, seed=job['seed'])
+
+    start = time.perf_counter()
+    result = gm.run_genetic_algorithm(
+        generations=job['generations'],
+        population_size=job['population'],
+        mode=job['mode'],
+        mutation_rate=job['mutation_rate'])
+    elapsed = time.perf_counter() - start
+
+    best_motif, best_score = result.best()
+    report = {
+        'job_id': job['job_id'],
+        'hexagram': job['hexagram'],
+        'mode': job['mode'],
+        'mutation_rate': job['mutation_rate'],
+        'harmonicity_ratio': job['harmonicity_ratio'],
+        **seed_fields(job),
+        'best_motif': [int(value) for value in best_motif],
+        'best_score': best_score,
+        'mean_score': float(np.mean(result.scores)),
+        'seconds': elapsed,
+        'pid': os.getpid(),
+    }
+    if job['render']:
+        report['population'] = result.population.tolist()
+        report['scores'] = result.scores.tolist()
+    return report
+
+
+# Queues the final population of a finished job on the render pipeline
+def render_report(pipeline, job, report):
+    gm = GeneticMusic(job['hexagram'], job['base_duration'], job['harmonicity_ratio'],
+                      cache_size=0, seed=job['render_seed'])
+    label = f"h{job['hexagram']:02d}_m{job['mode']}_j{job['job_id']}"
+    scores = report.pop('scores')
+    population = report.pop('population')
+    events = gm.render_events(population, job['mode'], job['dynamic_ratio'])
+    for i, motif in enumerate(population):
+        entry = {'hexagram': [job['hexagram']], 'mode': job['mode'], 'motif': motif,
+                 'fitness': scores[i], 'job_id': job['job_id'],
+                 'mutation_rate': job['mutation_rate'],
+                 'harmonicity_ratio': job['harmonicity_ratio'], **seed_fields(job)}
+        pipeline.submit(gm, events.music_sequences(i), entry, id=i,
+                        backend=job['midi_backend'], label=label)
+
+
+# Yields job reports in completion order
+def sweep(jobs, workers=None, cache_size=0):
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(cache_size,)) as executor:
+        futures = [executor.submit(run_sweep_job, job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the Genetic Music Algorithm over a parameter grid')
+    parser.add_argument('--hexagrams', type=parse_int_list, default=list(range(1, 65)),
+                        help='Hexagrams to sweep, e.g. "1-64" or "1,20,33"')
+    parser.add_argument('--modes', type=parse_int_list, default=list(range(1, 7)),
+                        help='Modes to sweep, e.g. "1-6"')
+    parser.add_argument('--mutation_rates', type=parse_float_list, default=[0.3],
+                        help='Comma separated mutation rates')
+    parser.add_argument('--harmonicity_ratios', type=parse_float_list, default=[0.3],
+                        help='Comma separated harmonicity ratios')
+    parser.add_argument('--generations', type=int,
+                        required=True, help='Number of generations per job')
+    parser.add_argument('--population', type=int,
+                        required=True, help='Size of the population')
+    parser.add_argument('--base_duration', type=int, default=4,
+                        help='Base duration for notes')
+    parser.add_argument('--dynamic_ratio', type=float, default=0.8,
+                        help='Dynamic ratio for high and low dynamics')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for the whole sweep; every job gets an independent stream')
+    parser.add_argument('--cache_size', type=int, default=0,
+                        help='Fitness cache size per worker process (0, the default, disables it)')
+    parser.add_argument('--render', action='store_true',
+                        help='Write MIDI files for every final population')
+    parser.add_argument('--midi_backend', choices=['direct', 'music21'], default='direct',
+                        help='Write MIDI bytes directly or through a music21 score')
+    parser.add_argument('--render_workers', type=int, default=2,
+                        help='Threads writing MIDI files in the parent process')
+    parser.add_argument('--render_queue', type=int, default=256,
+                        help='Maximum number of motifs waiting to be written')
+    parser.add_argument('--output', type=str, default=None,
+                        help='JSONL file for the job reports (stdout when omitted)')
+
+    args = parser.parse_args()
+    jobs = build_jobs(args.hexagrams, args.modes, args.mutation_rates, args.harmonicity_ratios,
+                      args.generations, args.population, args.base_duration, args.dynamic_ratio,
+                      seed=args.seed, render=args.render, midi_backend=args.midi_backend)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    # Rendered files of the whole sweep form one batch with one manifest
+    manifest = None
+    if args.render:
+        manifest = {'params': {'generations': args.generations, 'population': args.population,
+                               'base_duration': args.base_duration,
+                               'dynamic_ratio': args.dynamic_ratio, 'seed': args.seed}}
+    try:
+        with RenderPipeline(args.render_workers, args.render_queue, manifest,
+                            verbose=False) as pipeline:
+            for report in sweep(jobs, args.workers, args.cache_size):
+                if args.render:
+                    render_report(pipeline, jobs[report['job_id']], report)
+                output.write(json.dumps(report) + "\n")
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
@@ -1,79 +1,737 @@
-from music21 import note, stream, metadata
-import random
+import importlib.util
 import itertools
+import numpy as np
 from datetime import datetime
 import os
+import time
 import argparse
+import heapq
+import json
+import queue
+import socket
+import threading
+import uuid
+from collections import OrderedDict
+
+from ching_library import MotifLibrary
+from ching_stream import NoteStreamer
+
+# music21 is only needed by the music21 MIDI backend and takes longer to
+# import than a typical GA run, so it is loaded on first use by
+# load_music21()
+note = stream = metadata = None
+
+
+def load_music21():
+    global note, stream, metadata
+    if stream is None:
+        try:
+            from music21 import note as music21_note, stream as music21_stream, \
+                metadata as music21_metadata
+        except ImportError:
+            raise RuntimeError("the music21 MIDI backend requires music21 to be installed")
+        note, stream, metadata = music21_note, music21_stream, music21_metadata
+
+
+# music21 Score of (pitch, quarter length, velocity) parts, one Part each
+def music21_score(music_sequences):
+    load_music21()
+    score = stream.Score()
+    score.metadata = metadata.Metadata(title="Hexagram Music Composition")
+
+    for i, sequence in enumerate(music_sequences):
+        part = stream.Part()
+        part.id = f'Part {i+1}'
+        for pitch, duration, velocity in sequence:
+            if pitch is not None:
+                n = note.Note(pitch)
+                n.duration.quarterLength = duration
+                n.volume.velocity = velocity
+                part.append(n)
+            else:
+                r = note.Rest()
+                r.duration.quarterLength = duration
+                part.append(r)
+        score.append(part)
+    return score
+
+
+# True when music21 can be imported, without importing it
+def music21_available():
+    return importlib.util.find_spec('music21') is not None
+
+
+# Standard MIDI File encoding. Matches what music21 writes for our scores:
+# format 1, a conductor track with tempo and 4/4 time signature, then one
+# track per part with its notes on channel 1.
+MIDI_TICKS_PER_QUARTER = 10080
+
+
+def midi_variable_length(value):
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+def midi_track_chunk(events):
+    data = b''.join(midi_variable_length(delta) + event for delta, event in events)
+    return b'MTrk' + len(data).to_bytes(4, 'big') + data
+
+
+# Encodes parts of (pitch, quarter length, velocity) tuples, with pitch None
+# for rests, into the bytes of a format 1 Standard MIDI File
+def encode_midi(music_sequences, tempo_bpm=120, ticks_per_quarter=MIDI_TICKS_PER_QUARTER):
+    end_of_track = b'\xff\x2f\x00'
+    tempo = round(60000000 / tempo_bpm).to_bytes(3, 'big')
+    conductor = [
+        (0, b'\xff\x51\x03' + tempo),
+        (0, b'\xff\x58\x04\x04\x02\x18\x08'),
+        (ticks_per_quarter, end_of_track),
+    ]
+    tracks = [midi_track_chunk(conductor)]
+
+    for sequence in music_sequences:
+        events = [(0, b'\xff\x03\x00')]
+        # music21 only writes the pitch bend reset for a part with notes
+        if any(pitch is not None for pitch, _, _ in sequence):
+            events.append((0, b'\xe0\x00\x40'))
+        delta = 0
+        for pitch, duration, velocity in sequence:
+            ticks = round(duration * ticks_per_quarter)
+            if pitch is None:
+                delta += ticks
+                continue
+            events.append((delta, bytes((0x90, pitch, velocity))))
+            events.append((ticks, bytes((0x80, pitch, 0))))
+            delta = 0
+        # Trailing rests are dropped, as music21 does
+        events.append((ticks_per_quarter, end_of_track))
+        tracks.append(midi_track_chunk(events))
+
+    header = b'MThd' + (6).to_bytes(4, 'big') + (1).to_bytes(2, 'big') + \
+        len(tracks).to_bytes(2, 'big') + ticks_per_quarter.to_bytes(2, 'big')
+    return header + b''.join(tracks)
+
+
+# Directory every MIDI file and batch manifest is written to
+MIDI_DIR = "midi_generation"
+
+
+# Name shared by the files of one output batch: the time it started plus a
+# random token, so concurrent runs never write to the same file names
+def new_batch_id():
+    return f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
+
+
+# Hidden temporary name next to `path`; files are written there and renamed
+# into place, so a watcher never sees a partly written file
+def temporary_path(path):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f".{filename}.tmp")
+
+
+def write_midi_file(path, music_sequences, tempo_bpm=120):
+    with open(path, 'wb') as f:
+        f.write(encode_midi(music_sequences, tempo_bpm))
+
+
+# Least-recently-used cache of motif fitness scores keyed by (motif tuple, mode).
+# One instance can be passed to several GeneticMusic objects so that runs in
+# the same process share what they have already scored. `bypassed` counts
+# scores computed without consulting the cache (batches over
+# GeneticMusic.cache_batch_limit); they count as misses in hit_rate.
+class FitnessCache:
+    def __init__(self, maxsize=65536):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Returns the cached score or None, updating the hit/miss counters
+    def get(self, key):
+        score = self.entries.get(key)
+        if score is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return score
+
+    def put(self, key, score):
+        self.entries[key] = score
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses + self.bypassed
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+
+# Final state of a genetic algorithm run: the motifs, their fitness scores
+# (aligned by index) and the per-generation fitness statistics.
+class EvolutionResult:
+    # stop_reason says why evolution ended ('generations' when the full count
+    # ran, 'library' when main answered from the motif library, otherwise the
+    # ConvergenceMonitor criterion that fired) and
+    # generations_run how many generations were completed.
+    def __init__(self, population, scores, history, stop_reason='generations', generations_run=None):
+        self.population = population
+        self.scores = scores
+        self.history = history
+        self.stop_reason = stop_reason
+        self.generations_run = len(history) if generations_run is None else generations_run
+
+    # Returns the highest scoring motif and its score
+    def best(self):
+        index = int(np.argmax(self.scores))
+        return self.population[index], float(self.scores[index])
+
+
+# A population stored as one contiguous (individuals x motif length) int16
+# array, rests encoded as REST. Iterating or indexing yields plain lists of
+# ints, so it can stand in wherever a list of motifs was used. int16 holds
+# pitches up to 32767: at up to +7 per interval shift, a lineage starting at
+# the top of a mode could take about 4,600 upward shifts before
+# mutate_batch refuses to wrap it around.
+class MotifPopulation:
+    REST = -1
+    dtype = np.int16
+
+    def __init__(self, motifs):
+        self.motifs = np.ascontiguousarray(motifs, dtype=self.dtype)
+        if self.motifs.ndim != 2:
+            raise ValueError("motifs must be a 2-D (individuals x motif length) array")
+
+    @classmethod
+    def empty(cls, size, motif_length):
+        return cls(np.empty((size, motif_length), dtype=cls.dtype))
+
+    def __len__(self):
+        return len(self.motifs)
+
+    def __getitem__(self, index):
+        return self.motifs[index].tolist()
+
+    def __iter__(self):
+        return iter(self.motifs.tolist())
+
+    # NumPy array protocol: the buffer itself only when no copy is asked for
+    # and no conversion is needed, so np.array(population) is a real copy
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return self.motifs.astype(dtype or self.dtype, copy=True)
+        if dtype is None or np.dtype(dtype) == self.dtype:
+            return self.motifs
+        if copy is False:
+            raise ValueError(f"cannot convert the population to {np.dtype(dtype)} without a copy")
+        return self.motifs.astype(dtype)
+
+    def tolist(self):
+        return self.motifs.tolist()
+
+    # Reorders the individuals in place, e.g. by descending fitness
+    def reorder(self, order):
+        self.motifs[:] = self.motifs[order]
+
+
+# Rendered events of a batch of motifs as parallel arrays shaped
+# (motifs, parts, events) rather than a list of tuples per event: MIDI pitch
+# (REST for rests), quarter-length duration, velocity (0 for rests) and the
+# onset of each event within its part. Columns flatten to one row per
+# event; the tuple lists of hexagram_to_music are built only on demand.
+class EventTable:
+    REST = -1
+    pitch_dtype = np.int16
+    velocity_dtype = np.uint8
+
+    def __init__(self, pitch, duration, velocity):
+        self.pitch = pitch
+        self.duration = duration
+        self.velocity = velocity
+        self._onset = None
+
+    def __len__(self):
+        return len(self.pitch)
+
+    @property
+    def parts(self):
+        return self.pitch.shape[1]
+
+    @property
+    def onset(self):
+        if self._onset is None:
+            self._onset = np.cumsum(self.duration, axis=2) - self.duration
+        return self._onset
+
+    # Flat event columns: motif index, part index, onset, duration, pitch and
+    # velocity for every event, or only the sounding ones with notes_only
+    def columns(self, notes_only=False):
+        shape = self.pitch.shape
+        motif, part, _ = np.indices(shape).reshape(3, -1)
+        columns = {'motif': motif, 'part': part, 'onset': self.onset.ravel(),
+                   'duration': self.duration.ravel(), 'pitch': self.pitch.ravel(),
+                   'velocity': self.velocity.ravel()}
+        if notes_only:
+            sounding = columns['pitch'] != self.REST
+            columns = {name: column[sounding] for name, column in columns.items()}
+        return columns
+
+    # The (pitch, quarter length, velocity) parts of one motif, rests as
+    # (None, quarter length, None)
+    def music_sequences(self, index):
+        music_sequences = []
+        for part_pitches, part_durations, part_velocities in zip(
+                self.pitch[index].tolist(), self.duration[index].tolist(),
+                self.velocity[index].tolist()):
+            music_sequences.append([
+                (pitch, duration, velocity) if pitch != self.REST else (None, duration, None)
+                for pitch, duration, velocity in zip(part_pitches, part_durations, part_velocities)])
+        return music_sequences
+
+    def to_music21(self, index):
+        return music21_score(self.music_sequences(index))
+
+
+# Rows of a motif matrix packed into uint64 words, an exact key per row.
+# Values that fit in int16 (always the case for a MotifPopulation) are
+# packed four per word, others two.
+def motif_keys(motifs):
+    count, motif_length = motifs.shape
+    lane = np.int32
+    if motifs.dtype == np.int16 or (motifs.min() >= -2 ** 15 and motifs.max() < 2 ** 15):
+        lane = np.int16
+    per_word = 8 // np.dtype(lane).itemsize
+    words = -(-motif_length // per_word)
+    packed = np.zeros((count, words * per_word), dtype=lane)
+    packed[:, :motif_length] = motifs
+    return packed.view(np.uint64)
+
+
+# Distinct rows of a motif matrix and, for every row, the index of its
+# distinct motif. Rows are sorted by their packed keys, which is much faster
+# than np.unique(axis=0).
+def unique_motifs(motifs):
+    motifs = np.asarray(motifs)
+    count = len(motifs)
+    if count == 0:
+        return motifs, np.zeros(0, dtype=np.intp)
+    keys = motif_keys(motifs)
+    if keys.shape[1] == 1:
+        order = np.argsort(keys[:, 0], kind='stable')
+    else:
+        order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+    first = np.ones(count, dtype=bool)
+    first[1:] = np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)
+    inverse = np.empty(count, dtype=np.intp)
+    inverse[order] = np.cumsum(first) - 1
+    return motifs[order[first]], inverse
+
+
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+# One 64-bit hash per row of a motif matrix, mixed from its packed keys.
+# Sorting a single word is several times faster than sorting the keys.
+def motif_hashes(motifs):
+    keys = motif_keys(np.asarray(motifs))
+    hashes = np.zeros(len(keys), dtype=np.uint64)
+    for column in keys.T:
+        hashes = (hashes ^ column) * HASH_MULTIPLIER
+        hashes ^= hashes >> np.uint64(29)
+    return hashes
+
+
+# Number of slots in which two motifs (or aligned rows of motif matrices)
+# differ; the cheap distance used for crowding
+def motif_distance(motifs1, motifs2):
+    return np.count_nonzero(np.asarray(motifs1) != np.asarray(motifs2), axis=-1)
+
+
+# Writes metrics records as JSON lines to a file, or to a UDP socket when the
+# target looks like udp://host:port. Only every `every`-th generation is
+# recorded.
+class MetricsRecorder:
+    def __init__(self, target, every=1):
+        self.every = max(every, 1)
+        self.started = time.perf_counter()
+        if target.startswith('udp://'):
+            host, port = target[len('udp://'):].rsplit(':', 1)
+            self.address = (host, int(port))
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.file = None
+        else:
+            self.address = self.socket = None
+            self.file = open(target, 'a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def wants(self, generation):
+        return generation % self.every == 0
+
+    def record(self, record):
+        record['elapsed'] = time.perf_counter() - self.started
+        line = json.dumps(record) + "\n"
+        if self.socket is not None:
+            self.socket.sendto(line.encode(), self.address)
+        else:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+        if self.file is not None:
+            self.file.close()
+
+
+# Independent random generators for parallel jobs, all derived from one
+# seed: the same seed always yields the same streams, and no two overlap
+def spawn_generators(seed, count):
+    return [np.random.default_rng(child)
+            for child in np.random.SeedSequence(seed).spawn(count)]
+
+
+# Reads a checkpoint written by GeneticMusic.save_checkpoint
+def load_checkpoint(path):
+    with np.load(path) as data:
+        checkpoint = json.loads(str(data['meta']))
+        checkpoint['population'] = data['population']
+        checkpoint['scores'] = data['scores']
+    return checkpoint
+
+
+# Fraction of distinct motifs in a population (1.0 when every motif is unique)
+def population_diversity(population):
+    motifs = np.asarray(population)
+    if len(motifs) == 0:
+        return 0.0
+    return len(unique_motifs(motifs)[0]) / len(motifs)
+
+
+# Optional early stopping for run_genetic_algorithm. Criteria left as None are
+# disabled:
+#   patience       stop when neither the best nor the mean fitness has
+#                  improved for this many generations ('stagnation')
+#   min_diversity  stop when population_diversity falls below it ('diversity')
+#   time_budget    stop after this many seconds of evolution ('time_budget')
+class ConvergenceMonitor:
+    def __init__(self, patience=None, min_diversity=None, time_budget=None, tolerance=1e-9):
+        self.patience = patience
+        self.min_diversity = min_diversity
+        self.time_budget = time_budget
+        self.tolerance = tolerance
+        self.best = -np.inf
+        self.mean = -np.inf
+        self.stalled = 0
+        self.started = time.perf_counter()
+
+    def enabled(self):
+        return self.patience is not None or self.min_diversity is not None \
+            or self.time_budget is not None
+
+    # Progress towards the stagnation criterion, saved in checkpoints
+    def state(self):
+        return {'best': self.best, 'mean': self.mean, 'stalled': self.stalled}
+
+    def restore(self, state):
+        if state is not None:
+            self.best = state['best']
+            self.mean = state['mean']
+            self.stalled = state['stalled']
+
+    # Called with each new generation; returns the criterion that fired or None
+    def update(self, population, scores):
+        if self.patience is not None:
+            best = float(scores.max())
+            mean = float(scores.mean())
+            if best > self.best + self.tolerance or mean > self.mean + self.tolerance:
+                self.stalled = 0
+            else:
+                self.stalled += 1
+            self.best = max(self.best, best)
+            self.mean = max(self.mean, mean)
+            if self.stalled >= self.patience:
+                return 'stagnation'
+        if self.min_diversity is not None and \
+                population_diversity(population) < self.min_diversity:
+            return 'diversity'
+        if self.time_budget is not None and \
+                time.perf_counter() - self.started >= self.time_budget:
+            return 'time_budget'
+        return None
+
+
+# Slots per hexagram; long-form motifs are scored segment by segment
+SEGMENT_LENGTH = 6
+
+
+# Width of the segments a motif of `motif_length` slots is scored in. Motif
+# lengths that are not a whole number of hexagrams form a single segment.
+def segment_width(motif_length):
+    return SEGMENT_LENGTH if motif_length % SEGMENT_LENGTH == 0 else motif_length
+
+
+# Parent selection strategies understood by GeneticMusic.select_parent_pairs
+SELECTION_STRATEGIES = ('truncation', 'tournament', 'rank', 'proportional')
+
+
+# Indices of the `k` highest scores in linear time, earliest index first
+# among ties (the same set a stable descending sort would keep), returned in
+# index order
+def top_k_indices(scores, k):
+    scores = np.asarray(scores)
+    if k >= len(scores):
+        return np.arange(len(scores))
+    if k <= 0:
+        return np.arange(0)
+    threshold = np.partition(scores, len(scores) - k)[-k]
+    above = np.flatnonzero(scores > threshold)
+    tied = np.flatnonzero(scores == threshold)
+    return np.sort(np.concatenate([above, tied[:k - len(above)]]))
+
+
+# Static tables shared by every GeneticMusic instance, built once at import.
+# All 64 possible combinations of 6-character strings (hexagrams) using 'Y' and 'N'.
+# Each hexagram represents a unique pattern for generating musical motifs.
+HEXAGRAMS = [''.join(h) for h in itertools.product('YN', repeat=6)]
+
+MODES = {
+    # Ionian Mode (Major Scale)
+    1: [60, 62, 64, 65, 67, 69, 71],
+    2: [60, 62, 63, 65, 67, 69, 70],  # Dorian Mode # 60, 69
+    3: [60, 61, 63, 65, 67, 68, 70],  # Phrygian Mode # 60, 61
+    4: [60, 62, 64, 66, 67, 69, 71],  # Lydian Mode # 60, 66
+    5: [60, 62, 64, 65, 67, 69, 70],  # Mixolydian Mode #60, 70
+    # Aeolian Mode (Natural Minor Scale)
+    6: [60, 62, 63, 65, 67, 68, 70],  # 60, 68
+}
+
+# Extended range for each mode: two octaves down plus the original octave
+EXTENDED_MODES = {mode_key: [note - 24 for note in mode_notes] + mode_notes
+                  for mode_key, mode_notes in MODES.items()}
+
+# Preferred notes for each mode
+PREFERRED_NOTES = {
+    1: [60, 71],  # Ionian
+    2: [60, 69],  # Dorian
+    3: [60, 61],  # Phrygian
+    4: [60, 66],  # Lydian
+    5: [60, 70],  # Mixolydian
+    6: [60, 68],  # Aeolian
+}
+
+# Intervals every note of a motif may be shifted by in a mutation: consonant
+# ones while harmonicity_ratio exceeds the mutation rate, dissonant otherwise
+CONSONANT_INTERVALS = (3, 4, 5, 7)
+DISSONANT_INTERVALS = (1, 2, 6)
 
 
 class GeneticMusic:
-    def __init__(self, hexagram_number, base_duration, harmonicity_ratio):
-        # Generate all 64 possible combinations of 6-character strings (hexagrams) using 'Y' and 'N'.
-        # Each hexagram represents a unique pattern for generating musical motifs.
-        self.hexagrams = [''.join(h)
-                          for h in itertools.product('YN', repeat=6)]
-        self.initial_hexagram = self.hexagrams[hexagram_number - 1]
+    cache_batch_limit = 1024
+    # Rounds of fresh offspring tried for duplicate children before they are
+    # replaced by random individuals
+    dedupe_rounds = 3
+
+    # fitness_cache: a FitnessCache to share with other instances; when omitted
+    # a private one holding up to cache_size motifs is created. It is off
+    # (cache_size=0) by default: hit rates in a normal run are a few percent,
+    # and the lookups cost more than the vectorized scoring they save.
+    # All randomness comes from self.rng: pass `rng` (a numpy Generator, e.g.
+    # from spawn_generators) or a `seed`; with neither the run is unseeded.
+    # dedupe replaces children that repeat another child of the same
+    # generation (see replace_duplicates); crowding, when > 0, is the window
+    # size of the crowding replacement (see crowd).
+    def __init__(self, hexagram_number, base_duration, harmonicity_ratio,
+                 fitness_cache=None, cache_size=0, seed=None, rng=None,
+                 selection='truncation', tournament_size=3, dedupe=False, crowding=0):
+        self.hexagrams = HEXAGRAMS
+        # `hexagram_number` may also be a sequence of hexagrams (a reading and
+        # its changing-lines result, a walk through the 64, ...). The motif
+        # then has one 6-slot segment per hexagram and initial_hexagram
+        # holds their lines one after the other.
+        self.hexagram_sequence = np.atleast_1d(hexagram_number).tolist()
+        for number in self.hexagram_sequence:
+            if not 1 <= number <= len(self.hexagrams):
+                raise ValueError(f"hexagram must be between 1 and 64, not {number}")
+        self.initial_hexagram = ''.join(
+            self.hexagrams[number - 1] for number in self.hexagram_sequence)
         self.base_duration = base_duration
-        self.modes = {
-            # Ionian Mode (Major Scale)
-            1: [60, 62, 64, 65, 67, 69, 71],
-            2: [60, 62, 63, 65, 67, 69, 70],  # Dorian Mode # 60, 69
-            3: [60, 61, 63, 65, 67, 68, 70],  # Phrygian Mode # 60, 61
-            4: [60, 62, 64, 66, 67, 69, 71],  # Lydian Mode # 60, 66
-            5: [60, 62, 64, 65, 67, 69, 70],  # Mixolydian Mode #60, 70
-            # Aeolian Mode (Natural Minor Scale)
-            6: [60, 62, 63, 65, 67, 68, 70],  # 60, 68
+        self.modes = MODES
+        self.extended_modes = EXTENDED_MODES
+        self.preferred_notes = PREFERRED_NOTES
+        self.harmonicity_ratio = harmonicity_ratio
+        if fitness_cache is None and cache_size > 0:
+            fitness_cache = FitnessCache(cache_size)
+        self.fitness_cache = fitness_cache
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        self.selection = selection
+        self.tournament_size = tournament_size
+        self.dedupe = dedupe
+        self.crowding = crowding
 
-        }
-        # Extended range for each mode
-        self.extended_modes = {}
-        for mode_key, mode_notes in self.modes.items():
-            extended_notes = []
-            # Add notes from two octaves down
-            extended_notes += [note - 24 for note in mode_notes]
-            # Add notes from the original octave
-            extended_notes += mode_notes
-            # # Add notes from one octave up
-            # extended_notes += [note - 12 for note in mode_notes]
-            self.extended_modes[mode_key] = extended_notes
-
-        # Define preferred notes for each mode
-        self.preferred_notes = {
-            1: [60, 71],  # Ionian
-            2: [60, 69],  # Dorian
-            3: [60, 61],  # Phrygian
-            4: [60, 66],  # Lydian
-            5: [60, 70],  # Mixolydian
-            6: [60, 68],  # Aeolian
+    def reseed(self, seed):
+        self.rng = np.random.default_rng(seed)
 
-        }
-        self.harmonicity_ratio = harmonicity_ratio
+    # One random element of `values`, keeping its Python type
+    def pick(self, values):
+        return values[self.rng.integers(len(values))]
 
     def generate_initial_population(self, size=10, mode=None):
-        population = []
-        for _ in range(size):
-            # Select a random hexagram as the basis for a motif.
-            hexagram = self.initial_hexagram
-            print(hexagram)
-            motif = []
-            for char in hexagram:
-                if char == 'Y':
-                    # Choose a note from the mode
-                    note = random.choice(self.modes[mode])
-                else:
-                    # Use -1 to represent a rest
-                    note = -1
-                motif.append(note)
-            population.append(motif)
-        return population
+        hexagram = self.initial_hexagram
+        on_yang = np.array([char == 'Y' for char in hexagram], dtype=bool)
+        # 'Y' lines get a note from the mode, 'N' lines a rest (-1); all the
+        # notes for the whole population are drawn at once
+        population = np.full((size, len(hexagram)), -1, dtype=np.int64)
+        mode_notes = np.asarray(self.modes[mode])
+        population[:, on_yang] = self.rng.choice(mode_notes, (size, int(on_yang.sum())))
+        return population.tolist()
 
+    # Cached scores are stored per segment, so a long motif whose segments
+    # were seen before (in any position or motif) only needs melodic_interest
     def fitness_function(self, motif, mode):
+        if self.fitness_cache is None:
+            return self.score_motif(motif, mode)
+        score = self.melodic_interest(motif)
+        width = segment_width(len(motif))
+        for start in range(0, len(motif), width):
+            key = (tuple(motif[start:start + width]), mode)
+            segment_score = self.fitness_cache.get(key)
+            if segment_score is None:
+                segment_score = self.score_segment(motif[start:start + width], mode)
+                self.fitness_cache.put(key, segment_score)
+            score += segment_score
+        return score
+
+    # melodic_interest runs over the whole motif, so intervals across segment
+    # boundaries count; the other metrics are summed over the hexagram
+    # segments. For a single hexagram this is the plain sum of all five.
+    def score_motif(self, motif, mode):
+        score = self.melodic_interest(motif)
+        width = segment_width(len(motif))
+        for start in range(0, len(motif), width):
+            score += self.score_segment(motif[start:start + width], mode)
+        return score
+
+    def score_segment(self, segment, mode):
         score = 0
-        score += self.conformity_to_scale(motif, mode)
-        score += self.melodic_interest(motif)
-        score += self.rhythmic_complexity(motif)
-        score += self.motivic_development_potential(motif)
-        score += self.repetition_and_variation(motif)
+        score += self.conformity_to_scale(segment, mode)
+        score += self.rhythmic_complexity(segment)
+        score += self.motivic_development_potential(segment)
+        score += self.repetition_and_variation(segment)
+        return score
+
+    # Scores a whole population in one vectorized pass. `population` is a
+    # (population x motif length) integer matrix with rests encoded as -1, or
+    # anything np.asarray can turn into one (e.g. a list of motifs).
+    # Returns the same numbers as calling fitness_function on every row.
+    # Motifs are split into their hexagram segments and duplicate segments
+    # are collapsed first, so the cache is consulted once per distinct
+    # segment and only distinct misses are scored; offspring that share most
+    # segments with their parents cost little beyond melodic_interest. Past
+    # cache_batch_limit distinct segments a cache lookup costs more than
+    # vectorized scoring, so large diverse batches are scored directly.
+    def fitness_batch(self, population, mode):
+        motifs = np.asarray(population)
+        if motifs.ndim != 2:
+            raise ValueError("population must be a 2-D (individuals x motif length) array")
+        if self.fitness_cache is None or motifs.shape[0] == 0:
+            return self.score_batch(motifs, mode)
+
+        segments = motifs.reshape(-1, segment_width(motifs.shape[1]))
+        distinct, inverse = unique_motifs(segments)
+        if len(distinct) > self.cache_batch_limit:
+            distinct_scores = self.score_segment_batch(distinct, mode)
+            self.fitness_cache.bypassed += len(distinct)
+        else:
+            distinct_scores = np.empty(len(distinct), dtype=np.float64)
+            missing = []
+            keys = [(tuple(row), mode) for row in distinct.tolist()]
+            for i, key in enumerate(keys):
+                score = self.fitness_cache.get(key)
+                if score is None:
+                    missing.append(i)
+                else:
+                    distinct_scores[i] = score
+            if missing:
+                computed = self.score_segment_batch(distinct[missing], mode)
+                distinct_scores[missing] = computed
+                for i, score in zip(missing, computed.tolist()):
+                    self.fitness_cache.put(keys[i], score)
+        segment_scores = distinct_scores[inverse].reshape(len(motifs), -1)
+        return self.melodic_batch(motifs) + segment_scores.sum(axis=1)
+
+    # Uncached vectorized scoring behind fitness_batch
+    def score_batch(self, motifs, mode):
+        motifs = np.asarray(motifs, dtype=np.int64)
+        if motifs.shape[0] == 0:
+            return np.zeros(0, dtype=np.float64)
+        segments = motifs.reshape(-1, segment_width(motifs.shape[1]))
+        segment_scores = self.score_segment_batch(segments, mode).reshape(len(motifs), -1)
+        return self.melodic_batch(motifs) + segment_scores.sum(axis=1)
+
+    # melodic_interest of every row: intervals between consecutive notes,
+    # rests skipped. For every slot find the index of the most recent note up
+    # to and including it, then pair each note with the note before it.
+    def melodic_batch(self, motifs):
+        motifs = np.asarray(motifs, dtype=np.int64)
+        is_note = motifs != -1
+        positions = np.arange(motifs.shape[1])
+        last_note = np.maximum.accumulate(
+            np.where(is_note, positions, -1), axis=1)
+        prev_note = np.full_like(last_note, -1)
+        prev_note[:, 1:] = last_note[:, :-1]
+        has_interval = is_note & (prev_note >= 0)
+        prev_values = np.take_along_axis(
+            motifs, np.maximum(prev_note, 0), axis=1)
+        intervals = np.abs(motifs - prev_values)
+        interval_scores = np.where(
+            (intervals == 1) | (intervals == 2), 1.0,
+            np.where(intervals > 4, 2.0, 0.5))
+        return np.where(has_interval, interval_scores, 0.0).sum(axis=1)
+
+    # score_segment of every row of `segments`
+    def score_segment_batch(self, segments, mode):
+        segments = np.asarray(segments, dtype=np.int64)
+        is_note = segments != -1
+        note_count = is_note.sum(axis=1)
+        rest_count = segments.shape[1] - note_count
+
+        # conformity_to_scale: notes that belong to the mode
+        in_scale = np.isin(segments, self.modes[mode]) & is_note
+        score = in_scale.sum(axis=1).astype(np.float64)
+
+        # rhythmic_complexity and motivic_development_potential both reward
+        # segments that mix notes and rests
+        mixed = (note_count > 0) & (rest_count > 0)
+        score += 2 * mixed
+
+        # repetition_and_variation: 3 to 5 distinct values (rests included)
+        sorted_segments = np.sort(segments, axis=1)
+        unique_elements = 1 + \
+            (np.diff(sorted_segments, axis=1) != 0).sum(axis=1)
+        score += (unique_elements >= 3) & (unique_elements <= 5)
+
         return score
 
     # Checks how many notes in the motif conform to the chosen musical mode
@@ -126,46 +784,92 @@ class GeneticMusic:
         # Adjust the range based on your motif's possible diversity
         return 1 if 3 <= unique_elements <= 5 else 0
 
-    # Selects the top half of the population based on fitness scores for breeding
-    def select_parents(self, population, mode):
-        sorted_population = sorted(
-            population,
-            key=lambda motif: self.fitness_function(motif, mode),
-            reverse=True
-        )
-        return sorted_population[:len(sorted_population) // 2]
+    # Selects the top half of the population based on fitness scores for breeding.
+    # `scores` are the precomputed fitness values aligned with `population`;
+    # they are only recomputed when the caller does not provide them.
+    def select_parents(self, population, mode, scores=None):
+        if scores is None:
+            scores = self.fitness_batch(population, mode)
+        scores = np.asarray(scores)
+        # Partition out the top half, then order only that half; same ranking
+        # as sorted(..., reverse=True)
+        kept = top_k_indices(scores, len(population) // 2)
+        order = kept[np.argsort(-scores[kept], kind='stable')]
+        return [population[i] for i in order]
+
+    # Draws `count` parent pairs from the score array in one batch using
+    # self.selection, returning two index arrays into the population. Both
+    # parents of a pair are always distinct individuals.
+    #   truncation:   uniform over the top half (partitioned, not sorted)
+    #   tournament:   best of self.tournament_size uniform draws
+    #   rank:         probability proportional to the dense rank of the score
+    #   proportional: probability proportional to score - worst score
+    def select_parent_pairs(self, scores, count):
+        scores = np.asarray(scores, dtype=np.float64)
+        if self.selection not in SELECTION_STRATEGIES:
+            raise ValueError(f"unknown selection strategy: {self.selection}")
+        if self.selection == 'truncation':
+            pool = top_k_indices(scores, len(scores) // 2)
+            if len(pool) < 2:
+                raise ValueError("population must have at least 4 individuals")
+            first = self.rng.integers(0, len(pool), count)
+            second = self.rng.integers(0, len(pool) - 1, count)
+            second += second >= first
+            return pool[first], pool[second]
+
+        if len(scores) < 2:
+            raise ValueError("population must have at least 2 individuals")
+        first = self.draw_parents(scores, count)
+        second = self.draw_parents(scores, count)
+        same = np.flatnonzero(first == second)
+        for _ in range(8):
+            if not len(same):
+                break
+            second[same] = self.draw_parents(scores, len(same))
+            same = same[first[same] == second[same]]
+        # A few individuals can hold all the selection weight; pair the
+        # leftovers with a uniformly chosen other individual
+        second[same] = (first[same] + self.rng.integers(1, len(scores), len(same))) % len(scores)
+        return first, second
+
+    # `count` independent parent indices for the non-truncation strategies
+    def draw_parents(self, scores, count):
+        if self.selection == 'tournament':
+            contestants = self.rng.integers(0, len(scores), (count, self.tournament_size))
+            winners = np.argmax(scores[contestants], axis=1)
+            return contestants[np.arange(count), winners]
+        if self.selection == 'rank':
+            # Equal scores share a rank, so ties are equally likely
+            weights = np.unique(scores, return_inverse=True)[1].reshape(-1) + 1.0
+        else:
+            weights = scores - scores.min()
+        cumulative = np.cumsum(weights)
+        if cumulative[-1] <= 0:
+            return self.rng.integers(0, len(scores), count)
+        picks = np.searchsorted(cumulative, self.rng.random(count) * cumulative[-1], side='right')
+        return np.minimum(picks, len(scores) - 1)
 
     def crossover(self, parent1, parent2, mode):
-        crossover_point = random.randint(1, len(parent1) - 1)
+        crossover_point = int(self.rng.integers(1, len(parent1)))
         child = parent1[:crossover_point] + parent2[crossover_point:]
 
         # Introduce variety from extended modes in crossover
-        child = [random.choice(self.extended_modes[mode])
-                 if random.random() < 0.1 else note for note in child]
+        substitute = (self.rng.random(len(child)) < 0.1).tolist()
+        child = [self.pick(self.extended_modes[mode])
+                 if swap else note for note, swap in zip(child, substitute)]
         return child
 
     def mutate(self, motif, mode, generation, max_generations, mutation_rate):
-        mutation_point = random.randint(0, len(motif) - 1)
-        mutation_choice = random.random()
+        mutation_point = int(self.rng.integers(len(motif)))
+        mutation_choice = self.rng.random()
         hexagram = self.initial_hexagram  # Choose a random hexagram
-        print(hexagram)
         # Adjust mutation behavior based on the generation
         generation_factor = generation / max_generations
 
-        # Harmonicity-based mutation
-        consonant_intervals = [3, 4, 5, 7]  # More consonant intervals
-        dissonant_intervals = [1, 2, 6]  # More dissonant intervals
-
-        if self.harmonicity_ratio > mutation_rate:
-            # Choose more from consonant intervals
-            interval_choices = consonant_intervals
-        else:
-            # Choose more from random (dissonant) intervals
-            interval_choices = dissonant_intervals
-
-        # Apply mutation based on the selected interval set
-        if random.random() < mutation_rate:
-            interval = random.choice(interval_choices)
+        # Harmonicity-based mutation: shift every note by an interval from
+        # the set selected by harmonicity_ratio
+        if self.rng.random() < mutation_rate:
+            interval = self.pick(self.shift_intervals(mutation_rate))
             motif = [(note + interval if note != -1 else note)
                      for note in motif]
 
@@ -173,141 +877,860 @@ class GeneticMusic:
         if motif[mutation_point] == -1:  # If it's a rest
             if hexagram[mutation_point] == 'Y':
                 if mutation_choice < (0.5 + generation_factor * 0.2):
-                    motif[mutation_point] = random.choice(self.modes[mode])
+                    motif[mutation_point] = self.pick(self.modes[mode])
         else:  # If it's a note
             if hexagram[mutation_point] == 'Y':
                 if mutation_choice < (0.3 + generation_factor * 0.2):
-                    motif[mutation_point] = random.choice(self.modes[mode])
+                    motif[mutation_point] = self.pick(self.modes[mode])
             else:
                 if mutation_choice < 0.4:
                     motif[mutation_point] = -1
                 else:
-                    motif[mutation_point] = random.choice(
+                    motif[mutation_point] = self.pick(
                         self.extended_modes[mode])
 
         return motif
 
+    # Intervals mutate may shift a motif by for this mutation rate
+    def shift_intervals(self, mutation_rate):
+        if self.harmonicity_ratio > mutation_rate:
+            return CONSONANT_INTERVALS
+        return DISSONANT_INTERVALS
+
     # Generates a new population from the current one using selection, crossover, and mutation.
 
-    def generate_next_generation(self, current_generation, mode, generation, max_generations, mutation_rate):
-        parents = self.select_parents(current_generation, mode)
+    def generate_next_generation(self, current_generation, mode, generation, max_generations, mutation_rate, scores=None):
+        if scores is None:
+            scores = self.fitness_batch(current_generation, mode)
+        firsts, seconds = self.select_parent_pairs(scores, len(current_generation))
         next_generation = []
+        seen = set()
 
-        while len(next_generation) < len(current_generation):
-            parent1, parent2 = random.sample(parents, 2)
+        for first, second in zip(firsts.tolist(), seconds.tolist()):
+            parent1, parent2 = current_generation[first], current_generation[second]
             child = self.crossover(parent1, parent2, mode)
             child = self.mutate(child, mode, generation,
                                 max_generations, mutation_rate)
+            if self.dedupe:
+                # A child already in the next generation is bred again from
+                # a new pair, and finally replaced by a random individual
+                rounds = 0
+                while tuple(child) in seen and rounds < self.dedupe_rounds:
+                    first, second = self.select_parent_pairs(scores, 1)
+                    child = self.crossover(current_generation[int(first[0])],
+                                           current_generation[int(second[0])], mode)
+                    child = self.mutate(child, mode, generation,
+                                        max_generations, mutation_rate)
+                    rounds += 1
+                if tuple(child) in seen:
+                    child = self.random_motifs(1, mode)[0].tolist()
+                seen.add(tuple(child))
             next_generation.append(child)
 
+        if self.crowding:
+            children = np.array(next_generation)
+            self.crowd(np.asarray(current_generation), np.asarray(scores, dtype=np.float64),
+                       children, self.fitness_batch(children, mode))
+            next_generation = children.tolist()
         return next_generation
 
-    def run_genetic_algorithm(self, generations, population_size, mode, mutation_rate):
-        population = self.generate_initial_population(population_size, mode)
+    # Batch version of crossover: child i takes parents1[i] up to a random
+    # point and parents2[i] after it, then every slot has a 10% chance of being
+    # replaced by a note from the extended mode. Children are written into
+    # `out` when given.
+    def crossover_batch(self, parents1, parents2, mode, out=None):
+        count, motif_length = parents1.shape
+        if out is None:
+            out = np.empty_like(parents1)
+        crossover_points = self.rng.integers(1, motif_length, count)
+        from_first = np.arange(motif_length) < crossover_points[:, None]
+        np.copyto(out, parents2)
+        np.copyto(out, parents1, where=from_first)
 
-        for generation in range(generations):
-            population = sorted(population, key=lambda motif: self.fitness_function(
-                motif, mode), reverse=True)
-            population = self.generate_next_generation(
-                population, mode, generation, generations, mutation_rate)
+        extended = np.asarray(self.extended_modes[mode], dtype=out.dtype)
+        substitute = self.rng.random((count, motif_length)) < 0.1
+        substitutes = extended[self.rng.integers(0, len(extended), substitute.sum())]
+        out[substitute] = substitutes
+        return out
 
-        return population
+    # Batch version of mutate, applied in place to every row of `motifs`: the
+    # harmonicity-driven interval shift of all notes, then the hexagram-aware
+    # point mutation at one random slot per motif.
+    def mutate_batch(self, motifs, mode, generation, max_generations, mutation_rate):
+        count, motif_length = motifs.shape
+        rows = np.arange(count)
+        mutation_points = self.rng.integers(0, motif_length, count)
+        mutation_choices = self.rng.random(count)
+        generation_factor = generation / max_generations
 
-    # Converts a hexagram into a sequence of musical notes and rests based on the selected mode
-    def hexagram_to_music(self, motif, mode, dynamic_ratio):
-        extended_scale = self.extended_modes[mode]
-        music_sequences = []
+        interval_choices = np.array(self.shift_intervals(mutation_rate))
+        shifted = self.rng.random(count) < mutation_rate
+        intervals = np.where(
+            shifted, interval_choices[self.rng.integers(0, len(interval_choices), count)], 0)
+        # int16 would silently wrap a pitch shifted past its maximum around
+        # to a negative one
+        highest = int((motifs.max(axis=1) + intervals).max()) if count else 0
+        if highest > np.iinfo(motifs.dtype).max:
+            raise OverflowError(f"interval shifts raised a pitch to {highest}, beyond "
+                                f"{motifs.dtype} (at most {np.iinfo(motifs.dtype).max})")
+        motifs += np.where(motifs != -1, intervals[:, None], 0).astype(motifs.dtype)
 
-        for _ in range(3):  # Creating 3 parts for polyphony
-            sequence = []
-            for i, note_val in enumerate(motif):
-                note_duration = self.determine_note_duration(note_val)
-                if note_val != -1:
-                    selected_note = random.choice(extended_scale)
-                    dynamic_level = self.determine_dynamic_level(
-                        self.initial_hexagram[i], dynamic_ratio)
-                    n = note.Note(selected_note)
-                    n.duration.quarterLength = note_duration
-                    n.volume.velocity = dynamic_level
-                    sequence.append(n)
-                else:
-                    r = note.Rest()
-                    r.duration.quarterLength = note_duration
-                    sequence.append(r)
-            music_sequences.append(sequence)
+        current = motifs[rows, mutation_points]
+        is_rest = current == -1
+        on_yang = np.array([char == 'Y' for char in self.initial_hexagram])[mutation_points]
+        mode_notes = np.asarray(self.modes[mode])
+        extended = np.asarray(self.extended_modes[mode])
+        mode_choices = mode_notes[self.rng.integers(0, len(mode_notes), count)]
+        extended_choices = extended[self.rng.integers(0, len(extended), count)]
 
-        return music_sequences
+        # The point mutation rule of mutate, for every motif at once
+        replacement = current.copy()
+        to_mode_note = on_yang & np.where(
+            is_rest,
+            mutation_choices < (0.5 + generation_factor * 0.2),
+            mutation_choices < (0.3 + generation_factor * 0.2))
+        replacement[to_mode_note] = mode_choices[to_mode_note]
+        on_yin_note = ~is_rest & ~on_yang
+        replacement[on_yin_note & (mutation_choices < 0.4)] = -1
+        to_extended = on_yin_note & (mutation_choices >= 0.4)
+        replacement[to_extended] = extended_choices[to_extended]
+        motifs[rows, mutation_points] = replacement
+        return motifs
+
+    # Replaces the children in `out` (a MotifPopulation) that repeat another
+    # child with offspring of fresh parent pairs from `population`, for up to
+    # dedupe_rounds rounds, then with random individuals (random_motifs)
+    # wherever duplicates remain. Children are compared by motif_hashes: the
+    # hashes are sorted once, and the offspring of each round are only looked
+    # up in the hashes kept so far. Equal hashes count as duplicates; a
+    # 64-bit collision only means a distinct child is bred again. Returns
+    # (duplicates found, random replacements).
+    def replace_duplicates(self, population, scores, mode, generation, max_generations,
+                           mutation_rate, out):
+        hashes = motif_hashes(out.motifs)
+        order = np.argsort(hashes)
+        sorted_hashes = hashes[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+        repeated = np.sort(order[~first])
+        kept = sorted_hashes[first]
+        found = len(repeated)
+        for _ in range(self.dedupe_rounds):
+            if not len(repeated):
+                break
+            first, second = self.select_parent_pairs(scores, len(repeated))
+            children = self.crossover_batch(population.motifs[first], population.motifs[second],
+                                            mode)
+            out.motifs[repeated] = self.mutate_batch(children, mode, generation, max_generations,
+                                                     mutation_rate)
+            new_hashes = motif_hashes(out.motifs[repeated])
+            clash = kept[np.minimum(np.searchsorted(kept, new_hashes), len(kept) - 1)] == new_hashes
+            # Offspring of the same round can also repeat each other
+            distinct = np.zeros(len(repeated), dtype=bool)
+            distinct[np.unique(new_hashes, return_index=True)[1]] = True
+            clash |= ~distinct
+            accepted = np.sort(new_hashes[~clash])
+            kept = np.insert(kept, np.searchsorted(kept, accepted), accepted)
+            repeated = repeated[clash]
+        if len(repeated):
+            out.motifs[repeated] = self.random_motifs(len(repeated), mode)
+        return found, len(repeated)
+
+    # Crowding by restricted tournament replacement: every child is matched
+    # with the nearest (by motif_distance) of self.crowding randomly drawn
+    # parents and takes that parent's place when it scores at least as well;
+    # when several children beat the same parent the best of them wins. The
+    # next generation is the parents with these replacements, so a child
+    # only competes with a similar motif and distinct niches survive.
+    # `children` and `child_scores` are overwritten with the next generation;
+    # returns how many parents were replaced.
+    def crowd(self, parents, parent_scores, children, child_scores):
+        count = len(children)
+        window = self.rng.integers(0, len(parents), (count, self.crowding))
+        distances = motif_distance(parents[window], children[:, None, :])
+        nearest = window[np.arange(count), np.argmin(distances, axis=1)]
+        better = np.flatnonzero(child_scores >= parent_scores[nearest])
+        # Best challenger per parent: sort by parent, then by falling score
+        better = better[np.lexsort((-child_scores[better], nearest[better]))]
+        targets = nearest[better]
+        first = np.ones(len(better), dtype=bool)
+        first[1:] = targets[1:] != targets[:-1]
+        winners, targets = better[first], targets[first]
+        next_motifs = parents.copy()
+        next_scores = np.array(parent_scores, dtype=np.float64)
+        next_motifs[targets] = children[winners]
+        next_scores[targets] = child_scores[winners]
+        children[:] = next_motifs
+        child_scores[:] = next_scores
+        return len(winners)
+
+    # Array-backed generate_next_generation: draws all parent pairs of
+    # `population` (a MotifPopulation) at once with select_parent_pairs and
+    # writes the children into `out`, another MotifPopulation of equal size.
+    # When a `timings` dict is passed, the seconds spent in selection,
+    # crossover and mutation (and with dedupe, in replace_duplicates along
+    # with its counts) are stored in it.
+    def generate_next_generation_batch(self, population, scores, mode, generation, max_generations,
+                                       mutation_rate, out, timings=None):
+        if timings is not None:
+            started = time.perf_counter()
+        first, second = self.select_parent_pairs(scores, len(out))
+        if timings is not None:
+            selected = time.perf_counter()
+        self.crossover_batch(population.motifs[first], population.motifs[second],
+                             mode, out=out.motifs)
+        if timings is not None:
+            crossed = time.perf_counter()
+        self.mutate_batch(out.motifs, mode, generation, max_generations, mutation_rate)
+        if timings is not None:
+            mutated = time.perf_counter()
+            timings['selection'] = selected - started
+            timings['crossover'] = crossed - selected
+            timings['mutation'] = mutated - crossed
+        if self.dedupe:
+            duplicates, random_fill = self.replace_duplicates(
+                population, scores, mode, generation, max_generations, mutation_rate, out)
+            if timings is not None:
+                timings['dedupe'] = time.perf_counter() - mutated
+                timings['duplicates'] = duplicates
+                timings['random_fill'] = random_fill
+        return out
+
+    # Summary of one generation's scores, used for reporting
+    def fitness_statistics(self, generation, scores):
+        return {
+            'generation': generation,
+            'best': float(scores.max()),
+            'mean': float(scores.mean()),
+            'worst': float(scores.min()),
+        }
+
+    # Streams the evolution one generation at a time, yielding
+    # (generation, population, scores) for the initial population
+    # (generation 0) and after each of the `generations` breeding steps.
+    # Two population buffers are reused, so memory stays constant however
+    # many generations run; a yielded population is only valid until the
+    # generator is resumed (np.array(population) copies it). A `timings` dict, when
+    # given, holds the phase timings of the generation just yielded. With
+    # crowding the children are scored first and then compete with the
+    # parents nearest to them (see crowd).
+    # `resume`, a checkpoint from load_checkpoint, restarts from its
+    # population and random state: its generation is yielded first and
+    # breeding continues exactly as the checkpointed run would have.
+    def evolve(self, generations, population_size, mode, mutation_rate, timings=None, resume=None):
+        if resume is None:
+            start = 0
+            population = MotifPopulation(
+                self.generate_initial_population(population_size, mode))
+            scores = self.fitness_batch(population.motifs, mode)
+        else:
+            start = resume['generation']
+            population = MotifPopulation(resume['population'])
+            scores = resume['scores'].copy()
+            self.rng.bit_generator.state = resume['rng']
+        # Children are written into a second buffer and the two are swapped
+        spare = MotifPopulation.empty(*population.motifs.shape)
+        yield start, population, scores
+
+        for generation in range(start, generations):
+            population, spare = self.generate_next_generation_batch(
+                population, scores, mode, generation, generations, mutation_rate, spare,
+                timings), population
+            if timings is not None:
+                started = time.perf_counter()
+            parent_scores, scores = scores, self.fitness_batch(population.motifs, mode)
+            if timings is not None:
+                timings['evaluation'] = time.perf_counter() - started
+            if self.crowding:
+                if timings is not None:
+                    started = time.perf_counter()
+                replaced = self.crowd(spare.motifs, parent_scores, population.motifs, scores)
+                if timings is not None:
+                    timings['crowding'] = time.perf_counter() - started
+                    timings['crowding_replaced'] = replaced
+            yield generation + 1, population, scores
+
+    # One metrics record: phase timings, fitness statistics, population
+    # diversity, dedupe and crowding counts and fitness cache counters
+    def generation_metrics(self, generation, population, scores, timings):
+        record = self.fitness_statistics(generation, scores)
+        record['std'] = float(scores.std())
+        record['diversity'] = population_diversity(population)
+        record.update(timings)
+        if self.fitness_cache is not None:
+            record['cache_hits'] = self.fitness_cache.hits
+            record['cache_misses'] = self.fitness_cache.misses
+            record['cache_bypassed'] = self.fitness_cache.bypassed
+            record['cache_hit_rate'] = self.fitness_cache.hit_rate()
+        return record
+
+    # Each individual is scored exactly once per generation; the scores travel
+    # with the population through sorting, selection and reporting.
+    # patience, min_diversity and time_budget enable early stopping (see
+    # ConvergenceMonitor); the result records which criterion fired.
+    # on_generation, when given, is called with every item evolve yields.
+    # metrics, a MetricsRecorder, receives per-generation timings and
+    # statistics; with metrics=None nothing is timed.
+    # With `checkpoint` set, the run state is saved there every
+    # `checkpoint_every` generations and when the run ends; `resume` takes a
+    # checkpoint from load_checkpoint and continues up to `generations`
+    # (see check_resume).
+    def run_genetic_algorithm(self, generations, population_size, mode, mutation_rate,
+                              patience=None, min_diversity=None, time_budget=None,
+                              on_generation=None, metrics=None,
+                              checkpoint=None, checkpoint_every=None, resume=None):
+        history = []
+        monitor = ConvergenceMonitor(patience, min_diversity, time_budget)
+        stop_reason = 'generations'
+        timings = {} if metrics is not None else None
+        resumed_at = None
+        if resume is not None:
+            self.check_resume(resume, generations, mutation_rate)
+            history = list(resume['history'])
+            monitor.restore(resume['monitor'])
+            resumed_at = resume['generation']
+
+        for generation, population, scores in self.evolve(
+                generations, population_size, mode, mutation_rate, timings, resume):
+            if generation == resumed_at:
+                # Already reported and checked before the checkpoint was saved
+                if len(history) == generation < generations:
+                    history.append(self.fitness_statistics(generation, scores))
+                continue
+            if metrics is not None and metrics.wants(generation):
+                metrics.record(self.generation_metrics(
+                    generation, population, scores, timings))
+            if on_generation is not None:
+                on_generation(generation, population, scores)
+            if generation > 0 and monitor.enabled():
+                reason = monitor.update(population, scores)
+                if reason is not None:
+                    stop_reason = reason
+                    break
+            if generation < generations:
+                history.append(self.fitness_statistics(generation, scores))
+            if checkpoint is not None and checkpoint_every and \
+                    generation % checkpoint_every == 0 and generation < generations:
+                self.save_checkpoint(checkpoint, generation, population, scores, mode,
+                                     mutation_rate, history, monitor, generations)
+
+        if checkpoint is not None:
+            self.save_checkpoint(checkpoint, generation, population, scores, mode,
+                                 mutation_rate, history, monitor, generations)
+        return EvolutionResult(population, scores, history, stop_reason)
+
+    # A resumed run only continues exactly as the checkpointed one would have
+    # with the same breeding parameters, so any that differ are rejected with
+    # a ValueError. `generations` scales the mutation schedule and must match
+    # too, except when extending a run that has finished. Checkpoints from
+    # before a parameter was saved skip its check.
+    def check_resume(self, checkpoint, generations, mutation_rate):
+        current = {'mutation_rate': mutation_rate, 'harmonicity_ratio': self.harmonicity_ratio,
+                   'selection': self.selection, 'tournament_size': self.tournament_size,
+                   'dedupe': self.dedupe, 'crowding': self.crowding}
+        saved_generations = checkpoint.get('generations')
+        if saved_generations is not None and saved_generations > checkpoint['generation']:
+            current['generations'] = generations
+        mismatched = [f"{name}={checkpoint[name]} (not {value})"
+                      for name, value in current.items()
+                      if name in checkpoint and checkpoint[name] != value]
+        if mismatched:
+            raise ValueError("checkpoint was saved with " + ", ".join(mismatched))
+
+    # Writes the GA state (population, scores, generation counter, self.rng
+    # state, parameters, history) as an .npz file. `max_generations` is the
+    # length of the run, which sets the mutation schedule. The file is written under
+    # a temporary name and then renamed over `path`, so an interrupted save
+    # never leaves a truncated checkpoint behind.
+    def save_checkpoint(self, path, generation, population, scores, mode, mutation_rate,
+                        history, monitor=None, max_generations=None):
+        meta = {
+            'generation': generation,
+            'generations': max_generations,
+            'hexagram': self.initial_hexagram,
+            'mode': mode,
+            'mutation_rate': mutation_rate,
+            'base_duration': self.base_duration,
+            'harmonicity_ratio': self.harmonicity_ratio,
+            'selection': self.selection,
+            'tournament_size': self.tournament_size,
+            'dedupe': self.dedupe,
+            'crowding': self.crowding,
+            'history': history,
+            'monitor': monitor.state() if monitor is not None else None,
+            'rng': self.rng.bit_generator.state,
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, population=np.asarray(population, dtype=MotifPopulation.dtype),
+                     scores=np.asarray(scores, dtype=np.float64),
+                     meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+
+    # Candidate values for every slot of a motif built on the current hexagram:
+    # 'Y' slots hold a pitch from the mode or its extended range, 'N' slots are
+    # rests or one of the pitches that mutate can place there.
+    def motif_alphabets(self, mode):
+        pitches = sorted(set(self.extended_modes[mode]))
+        return [pitches if char == 'Y' else [-1] + pitches
+                for char in self.initial_hexagram]
+
+    # `count` motifs drawn uniformly from the whole motif space, slot by slot
+    # from motif_alphabets; far more varied than the initial population,
+    # whose 'Y' slots only hold notes of the mode
+    def random_motifs(self, count, mode):
+        alphabets = self.motif_alphabets(mode)
+        motifs = np.empty((count, len(alphabets)), dtype=MotifPopulation.dtype)
+        for slot, alphabet in enumerate(alphabets):
+            motifs[:, slot] = np.asarray(alphabet)[self.rng.integers(0, len(alphabet), count)]
+        return motifs
+
+    # Size of the motif space enumerated by exhaustive_search
+    def motif_space_size(self, mode):
+        size = 1
+        for alphabet in self.motif_alphabets(mode):
+            size *= len(alphabet)
+        return size
+
+    # Streams the whole motif space as (first index, motif matrix) batches so
+    # that it never has to be held in memory at once. Motif i is the
+    # mixed-radix decoding of i over the slot alphabets.
+    def enumerate_motifs(self, mode, batch_size=65536):
+        alphabets = [np.array(a, dtype=np.int64)
+                     for a in self.motif_alphabets(mode)]
+        total = self.motif_space_size(mode)
+        for start in range(0, total, batch_size):
+            indices = np.arange(start, min(start + batch_size, total),
+                                dtype=np.int64)
+            batch = np.empty((len(indices), len(alphabets)), dtype=np.int64)
+            for slot in range(len(alphabets) - 1, -1, -1):
+                radix = len(alphabets[slot])
+                batch[:, slot] = alphabets[slot][indices % radix]
+                indices = indices // radix
+            yield start, batch
+
+    def search_index_path(self, mode, index_dir):
+        return os.path.join(index_dir, f"{self.initial_hexagram}_mode{mode}.npz")
+
+    # Scores every valid motif for the current hexagram and mode and returns the
+    # top_k as an EvolutionResult (best first, ties broken by enumeration
+    # order). When index_dir is given the ranking is saved there and later
+    # calls for the same hexagram and mode are answered from the file.
+    def exhaustive_search(self, mode, top_k=10, batch_size=65536, index_dir=None):
+        if len(self.hexagram_sequence) > 1:
+            raise ValueError("exhaustive search covers a single hexagram")
+        if index_dir is not None:
+            index_path = self.search_index_path(mode, index_dir)
+            if os.path.exists(index_path):
+                with np.load(index_path) as index:
+                    if len(index['scores']) >= top_k or \
+                            int(index['space_size']) == len(index['scores']):
+                        motifs = index['motifs'][:top_k]
+                        scores = index['scores'][:top_k]
+                        return EvolutionResult(motifs.tolist(), scores, [])
+
+        # Min-heap of (score, -index, motif) holding the best top_k seen so far
+        heap = []
+        for start, batch in self.enumerate_motifs(mode, batch_size):
+            scores = self.score_batch(batch, mode)
+            if len(scores) > top_k:
+                # Batch top_k in linear time, earliest motifs first among ties
+                candidates = top_k_indices(scores, top_k)
+            else:
+                candidates = np.arange(len(scores))
+            for i in candidates.tolist():
+                entry = (scores[i], -(start + i), batch[i].tolist())
+                if len(heap) < top_k:
+                    heapq.heappush(heap, entry)
+                elif entry[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, entry)
+
+        ranked = sorted(heap, key=lambda entry: entry[:2], reverse=True)
+        motifs = [entry[2] for entry in ranked]
+        scores = np.array([entry[0] for entry in ranked], dtype=np.float64)
+
+        if index_dir is not None:
+            os.makedirs(index_dir, exist_ok=True)
+            tmp_path = index_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, motifs=np.array(motifs, dtype=np.int64).reshape(len(motifs), -1),
+                         scores=scores, space_size=self.motif_space_size(mode))
+            os.replace(tmp_path, index_path)
+
+        return EvolutionResult(motifs, scores, [])
+
+    # Converts a hexagram into a sequence of musical notes and rests based on the selected mode.
+    # Each part is a list of (pitch, quarter length, velocity) tuples; rests
+    # have pitch and velocity None. Same draws as render_events for this one
+    # motif.
+    def hexagram_to_music(self, motif, mode, dynamic_ratio, parts=3):
+        return self.render_events([motif], mode, dynamic_ratio, parts).music_sequences(0)
+
+    # Renders many motifs at once into an EventTable. Each motif consumes
+    # one block of uniforms covering every draw (pitch, duration, dynamic
+    # side and velocity for each event of each part), so rendering a batch
+    # gives the same music as calling hexagram_to_music on each motif in
+    # turn. Motifs are drawn `batch_size` at a time to bound memory.
+    def render_events(self, motifs, mode, dynamic_ratio, parts=3, batch_size=8192):
+        motifs = np.asarray(motifs, dtype=np.int64)
+        if motifs.ndim != 2:
+            raise ValueError("motifs must be a 2-D (motifs x motif length) array")
+        count, motif_length = motifs.shape
+        extended_scale = np.asarray(self.extended_modes[mode])
+        on_yang = np.frombuffer(self.initial_hexagram[:motif_length].encode(), dtype=np.uint8) == ord('Y')
+        note_factors = np.array([1, 1.5, 2])
+        rest_factors = np.array([0.5, 0.75, 1])
+
+        pitch = np.empty((count, parts, motif_length), dtype=EventTable.pitch_dtype)
+        duration = np.empty((count, parts, motif_length), dtype=np.float64)
+        velocity = np.empty((count, parts, motif_length), dtype=EventTable.velocity_dtype)
+        for start in range(0, count, batch_size):
+            stop = min(start + batch_size, count)
+            is_note = (motifs[start:stop] != -1)[:, None, :]
+            uniforms = self.rng.random((stop - start, 4, parts, motif_length))
+            pitch_u, duration_u, side_u, velocity_u = (uniforms[:, k] for k in range(4))
+            pitches = extended_scale[(pitch_u * len(extended_scale)).astype(np.intp)]
+            pitch[start:stop] = np.where(is_note, pitches, -1)
+            duration_index = (duration_u * 3).astype(np.intp)
+            duration[start:stop] = self.base_duration * np.where(
+                is_note, note_factors[duration_index], rest_factors[duration_index])
+            # 'Y' lines favour the high dynamics (80-119) with probability
+            # dynamic_ratio, 'N' lines favour the low ones (60-79)
+            favoured = side_u < dynamic_ratio
+            loud = np.where(on_yang, favoured, ~favoured)
+            velocities = np.where(loud, 80 + (velocity_u * 40).astype(np.intp),
+                                  60 + (velocity_u * 20).astype(np.intp))
+            velocity[start:stop] = np.where(is_note, velocities, 0)
+        return EventTable(pitch, duration, velocity)
 
     def determine_dynamic_level(self, hex_char, dynamic_ratio):
         high_dynamics = range(80, 120)
         low_dynamics = range(60, 80)
         if hex_char == 'Y':
-            return random.choice(high_dynamics) if random.random() < dynamic_ratio else random.choice(low_dynamics)
+            return self.pick(high_dynamics) if self.rng.random() < dynamic_ratio else self.pick(low_dynamics)
         else:
-            return random.choice(low_dynamics) if random.random() < dynamic_ratio else random.choice(high_dynamics)
+            return self.pick(low_dynamics) if self.rng.random() < dynamic_ratio else self.pick(high_dynamics)
 
     def determine_note_duration(self, note):
         if note != -1:  # If it's a note
             # Introduce more variation in note durations
-            return self.base_duration * random.choice([1, 1.5, 2])
+            return self.base_duration * self.pick([1, 1.5, 2])
         else:  # If it's a rest
-            return self.base_duration * random.choice([0.5, 0.75, 1])
+            return self.base_duration * self.pick([0.5, 0.75, 1])
 
     def create_music21_score(self, music_sequences):
-        score = stream.Score()
-        score.metadata = metadata.Metadata(title="Hexagram Music Composition")
-
-        for i, sequence in enumerate(music_sequences):
-            part = stream.Part()
-            part.id = f'Part {i+1}'
-            for music_note in sequence:
-                part.append(music_note)
-            score.append(part)
-        return score
+        return music21_score(music_sequences)
 
-    # Save the score as a MIDI file
-    def save_as_midi(self, music_sequences, id=0):
-        # Generate a date prefix for the filename
-        date_prefix = datetime.now().strftime("%Y%m%d")
-        midi_dir = "midi_generation"
-        os.makedirs(midi_dir, exist_ok=True)
+    # Save the score as a MIDI file. The 'direct' backend encodes the event
+    # tuples straight to bytes; 'music21' builds and writes a music21 score.
+    # Files are named `<batch>_<label>_<id>_hexagram_music.mid`: `batch`
+    # groups the files of one run (a fresh batch id when omitted) and `label`
+    # keeps files from different jobs apart. The file is written under a
+    # temporary name and renamed into place.
+    # verbose=False skips the "saved as" line, for callers whose stdout is
+    # machine-readable (the JSON lines of the sweep and island scripts).
+    def save_as_midi(self, music_sequences, id=0, backend='direct', label=None, batch=None,
+                     verbose=True):
+        if batch is None:
+            batch = new_batch_id()
+        os.makedirs(MIDI_DIR, exist_ok=True)
 
         # Format the sequential number with leading zeros
         sequential_number = f"{id:02d}"
-        filename = f"{date_prefix}_{sequential_number}_hexagram_music.mid"
+        if label is not None:
+            sequential_number = f"{label}_{sequential_number}"
+        filename = f"{batch}_{sequential_number}_hexagram_music.mid"
 
         # Complete file path
-        midi_path = os.path.join(midi_dir, filename)
-        score = self.create_music21_score(music_sequences)
-        score.write('midi', fp=midi_path)
-        print(f"MIDI file saved as {midi_path}")
+        midi_path = os.path.join(MIDI_DIR, filename)
+        tmp_path = temporary_path(midi_path)
+        if backend == 'music21':
+            score = self.create_music21_score(music_sequences)
+            score.write('midi', fp=tmp_path)
+        else:
+            write_midi_file(tmp_path, music_sequences)
+        os.replace(tmp_path, midi_path)
+        if verbose:
+            print(f"MIDI file saved as {midi_path}")
+        return midi_path
+
+
+# Producer/consumer output stage: motifs that are ready to render are queued
+# and a pool of worker threads writes them as MIDI files while the caller
+# carries on evolving. The queue is bounded, so when the disk falls behind
+# submit() blocks instead of letting pending scores pile up in memory.
+# With workers=0 every file is written synchronously in submit().
+# All files of a pipeline share one batch id. When `manifest` (a dict of
+# batch-level fields such as run parameters) is given, close() writes
+# `<batch>_manifest.json` listing every file with its submitted entry, once
+# all files are in place, so consumers can react once per batch.
+# verbose is passed on to save_as_midi.
+class RenderPipeline:
+    def __init__(self, workers=2, max_pending=64, manifest=None, verbose=True):
+        self.batch = new_batch_id()
+        self.verbose = verbose
+        self.manifest = manifest
+        self.manifest_path = None
+        self.entries = {}
+        self.closed = False
+        self.jobs = queue.Queue(maxsize=max(max_pending, 1))
+        self.paths = {}
+        self.published = set()
+        self.errors = []
+        self.submitted = 0
+        self.threads = [threading.Thread(target=self.run_worker, daemon=True)
+                        for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(raise_errors=exc_type is None, write_manifest=exc_type is None)
+
+    # Queues one save_as_midi call; the keyword arguments are passed through.
+    # `entry` is a JSON-ready dict (motif, fitness, ...) describing the file
+    # in the manifest. With publish=True the file gets a manifest of its own
+    # as soon as it is written, so a watcher can pick it up while the run
+    # continues (progressive --render_every output); it is then left out of
+    # the final manifest. Returns the submission index, the key of the path
+    # in self.paths.
+    def submit(self, gm, music_sequences, entry=None, publish=False, **save_kwargs):
+        save_kwargs.setdefault('batch', self.batch)
+        save_kwargs.setdefault('verbose', self.verbose)
+        index = self.submitted
+        self.submitted += 1
+        if entry is not None:
+            self.entries[index] = entry
+        if self.threads:
+            self.jobs.put((index, gm, music_sequences, publish, save_kwargs))
+        else:
+            self.save(index, gm, music_sequences, publish, save_kwargs)
+        return index
+
+    def save(self, index, gm, music_sequences, publish, save_kwargs):
+        self.paths[index] = gm.save_as_midi(music_sequences, **save_kwargs)
+        if publish and self.manifest is not None:
+            self.write_manifest([index], f"{self.batch}_{index:04d}")
+            self.published.add(index)
+
+    def run_worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            try:
+                self.save(*job)
+            except Exception as error:
+                self.errors.append(error)
+
+    # Waits for every queued file to be written, then writes the manifest of
+    # the files not already published, unless a file failed
+    def close(self, raise_errors=True, write_manifest=True):
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if write_manifest and self.manifest is not None and not self.errors:
+            remaining = [index for index in sorted(self.paths) if index not in self.published]
+            if remaining or not self.published:
+                self.manifest_path = self.write_manifest(remaining)
+        if raise_errors and self.errors:
+            raise self.errors[0]
+
+    # Writes <name>_manifest.json (name defaults to the batch id) listing the
+    # files of the given submission indices, and returns its path
+    def write_manifest(self, indices, name=None):
+        files = [dict(self.entries.get(index, {}), file=os.path.basename(self.paths[index]),
+                      path=os.path.abspath(self.paths[index]))
+                 for index in indices]
+        manifest = dict(self.manifest, batch=self.batch,
+                        created=datetime.now().isoformat(timespec='seconds'),
+                        count=len(files), files=files)
+        os.makedirs(MIDI_DIR, exist_ok=True)
+        manifest_path = os.path.join(MIDI_DIR, f"{name or self.batch}_manifest.json")
+        tmp_path = temporary_path(manifest_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+        return manifest_path
+
+    # Paths written so far, in submission order
+    def written(self):
+        return [self.paths[index] for index in sorted(self.paths)]
 
 # Main
 
 
-def main(generations, population_size, hexagram_number, base_duration, mutation_rate, harmonicity_ratio, dynamic_ratio):
-    gm = GeneticMusic(hexagram_number, base_duration, harmonicity_ratio)
-    mode = random.choice(list(gm.modes.keys()))
+def main(generations, population_size, hexagram_number, base_duration, mutation_rate, harmonicity_ratio, dynamic_ratio,
+         cache_size=0, search='ga', index_dir=None, midi_backend='direct',
+         patience=None, min_diversity=None, time_budget=None, render_every=None,
+         render_workers=2, render_queue=64, metrics=None, metrics_every=1,
+         checkpoint=None, checkpoint_every=None, resume=False, seed=None,
+         selection='truncation', tournament_size=3, mode=None, library=None,
+         from_library=False, stream=None, stream_count=1, dedupe=False, crowding=0, gm=None,
+         streamer=None):
+    # A long-running caller (see ching_server.py) passes in a warm instance,
+    # and for --stream a running NoteStreamer for that destination
+    if gm is None:
+        gm = GeneticMusic(hexagram_number, base_duration,
+                          harmonicity_ratio, cache_size=cache_size, seed=seed)
+    elif seed is not None:
+        gm.reseed(seed)
+    gm.selection = selection
+    gm.tournament_size = tournament_size
+    gm.dedupe = dedupe
+    gm.crowding = crowding
+    if mode is None:
+        mode = gm.pick(list(gm.modes.keys()))
+    resume_state = None
+    if resume:
+        if checkpoint is None or not os.path.exists(checkpoint):
+            raise FileNotFoundError(f"no checkpoint to resume from: {checkpoint}")
+        resume_state = load_checkpoint(checkpoint)
+        if resume_state['hexagram'] != gm.initial_hexagram:
+            raise ValueError(
+                f"checkpoint is for hexagram {resume_state['hexagram']}, not {gm.initial_hexagram}")
+        mode = resume_state['mode']
+
+    # A request the library can already answer skips the search
+    stored = None
+    if library is not None and from_library and resume_state is None:
+        with MotifLibrary(library) as store:
+            stored = store.top(gm.hexagram_sequence, mode, population_size)
+        if len(stored) < population_size:
+            stored = None
 
-    final_motifs = gm.run_genetic_algorithm(
-        generations=generations,
-        population_size=population_size,
-        mode=mode,
-        mutation_rate=mutation_rate)
+    params = {'search': search, 'generations': generations, 'population': population_size,
+              'base_duration': gm.base_duration, 'mutation_rate': mutation_rate,
+              'harmonicity_ratio': gm.harmonicity_ratio, 'dynamic_ratio': dynamic_ratio,
+              'selection': gm.selection, 'dedupe': gm.dedupe, 'crowding': gm.crowding,
+              'seed': seed}
+    manifest = {'hexagram': gm.hexagram_sequence, 'mode': mode, 'params': params}
+    # With --stream motifs are played as OSC note events instead of files.
+    # A streamer of our own is started before the run, so its process is up
+    # by the time the first motif is ready.
+    own_streamer = bool(stream) and streamer is None
+    if own_streamer:
+        streamer = NoteStreamer(stream)
+    if not stream:
+        streamer = None
+    if streamer is not None:
+        manifest = None
 
-    for i, motif in enumerate(final_motifs):
-        music_sequences = gm.hexagram_to_music(motif, mode, dynamic_ratio)
-        gm.save_as_midi(music_sequences, id=i)
+    try:
+        # MIDI files are written by the pipeline while evolution continues
+        with RenderPipeline(render_workers, render_queue, manifest) as pipeline:
+            if stored is not None:
+                result = EvolutionResult([entry['motif'] for entry in stored],
+                                         np.array([entry['fitness'] for entry in stored]),
+                                         [], stop_reason='library', generations_run=0)
+            elif search == 'exhaustive':
+                # The population size doubles as the number of ranked motifs to keep
+                result = gm.exhaustive_search(
+                    mode, top_k=population_size, index_dir=index_dir)
+            else:
+                on_generation = None
+                if render_every:
+                    # Rendering draws from its own stream, derived from the
+                    # seed, so --render_every leaves the evolution unchanged
+                    renderer = GeneticMusic(gm.hexagram_sequence, gm.base_duration,
+                                            gm.harmonicity_ratio,
+                                            seed=None if seed is None else [seed, 1])
 
+                    # Write the current best motif while evolution continues
+                    def on_generation(generation, population, scores):
+                        if generation % render_every == 0:
+                            best_index = int(np.argmax(scores))
+                            best = population[best_index]
+                            entry = {'hexagram': gm.hexagram_sequence, 'mode': mode,
+                                     'motif': [int(value) for value in best],
+                                     'fitness': float(scores[best_index]), 'generation': generation}
+                            music_sequences = renderer.hexagram_to_music(best, mode, dynamic_ratio)
+                            if streamer is not None:
+                                # Skipped while earlier motifs are still queued
+                                streamer.submit(music_sequences, block=False)
+                            else:
+                                pipeline.submit(gm, music_sequences, entry, publish=True,
+                                                id=generation, backend=midi_backend,
+                                                label='best')
 
-if __name__ == "__main__":
+                recorder = MetricsRecorder(metrics, metrics_every) if metrics else None
+                try:
+                    result = gm.run_genetic_algorithm(
+                        generations=generations,
+                        population_size=population_size,
+                        mode=mode,
+                        mutation_rate=mutation_rate,
+                        patience=patience,
+                        min_diversity=min_diversity,
+                        time_budget=time_budget,
+                        on_generation=on_generation,
+                        metrics=recorder,
+                        checkpoint=checkpoint,
+                        checkpoint_every=checkpoint_every,
+                        resume=resume_state)
+                finally:
+                    if recorder is not None:
+                        recorder.close()
+                if result.stop_reason != 'generations':
+                    print(f"Stopped after {result.generations_run} generations ({result.stop_reason})")
+
+            submitted = []
+            if streamer is not None:
+                # The best stream_count motifs, best first, played back to back
+                best = np.argsort(-np.asarray(result.scores), kind='stable')[:stream_count]
+                events = gm.render_events(np.asarray(result.population)[best], mode, dynamic_ratio)
+                for i in range(len(events)):
+                    streamer.submit(events.music_sequences(i))
+                if own_streamer:
+                    streamer.close()
+                else:
+                    streamer.drain()
+                statistics = streamer.statistics()
+                print(f"Streamed {statistics['events']} note events to {stream} "
+                      f"(max jitter {statistics['max_jitter'] * 1000:.2f} ms)")
+            else:
+                # The whole population is rendered in one batch of draws
+                events = gm.render_events(result.population, mode, dynamic_ratio)
+                for i, motif in enumerate(result.population):
+                    music_sequences = events.music_sequences(i)
+                    entry = {'hexagram': gm.hexagram_sequence, 'mode': mode,
+                             'motif': [int(value) for value in motif],
+                             'fitness': float(result.scores[i])}
+                    submitted.append(pipeline.submit(gm, music_sequences, entry,
+                                                     id=i, backend=midi_backend))
+    finally:
+        if own_streamer:
+            streamer.close(wait=False)
+
+    if library is not None:
+        with MotifLibrary(library) as store:
+            motif_ids = store.add_many(result.population, result.scores,
+                                       gm.hexagram_sequence, mode, params)
+            store.add_renders(motif_ids, [os.path.abspath(pipeline.paths[index])
+                                          if index in pipeline.paths else None
+                                          for index in submitted])
+    return pipeline.written()
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description='Run Genetic Music Algorithm')
     parser.add_argument('--generations', type=int,
                         required=True, help='Number of generations to run')
     parser.add_argument('--population', type=int,
                         required=True, help='Size of the population')
-    parser.add_argument('--hexagram', type=int, required=True,
-                        choices=range(1, 65), help='Hexagram number (1-64)')
+    parser.add_argument('--hexagram', type=int, nargs='+', required=True,
+                        choices=range(1, 65),
+                        help='Hexagram number (1-64), or several for a long-form phrase')
     parser.add_argument('--base_duration', type=int,
                         required=True, help='Base duration for notes')
     parser.add_argument('--mutation_rate', type=float,
@@ -316,7 +1739,77 @@ if __name__ == "__main__":
                         required=True, help='Harmonicity ratio from 0 to 1')
     parser.add_argument('--dynamic_ratio', type=float, required=True,
                         help='Dynamic ratio for high and low dynamics')
+    parser.add_argument('--cache_size', type=int, default=0,
+                        help='Maximum number of motif scores kept in the fitness cache '
+                             '(0, the default, disables it)')
+    parser.add_argument('--search', choices=['ga', 'exhaustive'], default='ga',
+                        help='Evolve motifs with the genetic algorithm or rank the whole motif space')
+    parser.add_argument('--index_dir', type=str, default=None,
+                        help='Directory where exhaustive search rankings are stored and reused')
+    parser.add_argument('--midi_backend', choices=['direct', 'music21'], default='direct',
+                        help='Write MIDI bytes directly or through a music21 score')
+    parser.add_argument('--patience', type=int, default=None,
+                        help='Stop when best and mean fitness have not improved for this many generations')
+    parser.add_argument('--min_diversity', type=float, default=None,
+                        help='Stop when the fraction of distinct motifs falls below this value')
+    parser.add_argument('--time_budget', type=float, default=None,
+                        help='Stop evolving after this many seconds')
+    parser.add_argument('--render_every', type=int, default=None,
+                        help='Write the best motif every K generations while evolving')
+    parser.add_argument('--render_workers', type=int, default=2,
+                        help='Threads writing MIDI files in the background (0 writes synchronously)')
+    parser.add_argument('--render_queue', type=int, default=64,
+                        help='Maximum number of motifs waiting to be written')
+    parser.add_argument('--metrics', type=str, default=None,
+                        help='Write per-generation metrics as JSON lines to this file or udp://host:port')
+    parser.add_argument('--metrics_every', type=int, default=1,
+                        help='Record metrics every N generations')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='File where the GA state is saved (and resumed from with --resume)')
+    parser.add_argument('--checkpoint_every', type=int, default=None,
+                        help='Save a checkpoint every N generations')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the run saved in --checkpoint up to --generations')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for all random choices, making the run reproducible')
+    parser.add_argument('--mode', type=int, default=None, choices=range(1, 7),
+                        help='Mode (1-6), random when omitted')
+    parser.add_argument('--library', type=str, default=None,
+                        help='Record the final motifs, their fitness and MIDI files in this SQLite library')
+    parser.add_argument('--from_library', action='store_true',
+                        help='Answer from --library when it already holds enough motifs for the hexagram and mode')
+    parser.add_argument('--stream', type=str, default=None,
+                        help='Play motifs as OSC note events to udp://host:port instead of writing MIDI files')
+    parser.add_argument('--stream_count', type=int, default=1,
+                        help='Number of final motifs to play with --stream, best first')
+    parser.add_argument('--selection', choices=SELECTION_STRATEGIES, default='truncation',
+                        help='Parent selection strategy')
+    parser.add_argument('--tournament_size', type=int, default=3,
+                        help='Contestants per draw for --selection tournament')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='Replace children that duplicate another child of the generation')
+    parser.add_argument('--crowding', type=int, default=0,
+                        help='Crowding window: each child competes with the nearest of this '
+                             'many random parents (0 disables)')
+    return parser
+
 
-    args = parser.parse_args()
-    main(args.generations, args.population, args.hexagram, args.base_duration,
-         args.mutation_rate, args.harmonicity_ratio, args.dynamic_ratio)
+def run_from_args(args, gm=None, streamer=None):
+    return main(args.generations, args.population, args.hexagram, args.base_duration,
+                args.mutation_rate, args.harmonicity_ratio, args.dynamic_ratio,
+                cache_size=args.cache_size, search=args.search, index_dir=args.index_dir,
+                midi_backend=args.midi_backend, patience=args.patience,
+                min_diversity=args.min_diversity, time_budget=args.time_budget,
+                render_every=args.render_every, render_workers=args.render_workers,
+                render_queue=args.render_queue, metrics=args.metrics,
+                metrics_every=args.metrics_every, checkpoint=args.checkpoint,
+                checkpoint_every=args.checkpoint_every, resume=args.resume, seed=args.seed,
+                selection=args.selection, tournament_size=args.tournament_size,
+                mode=args.mode, library=args.library, from_library=args.from_library,
+                stream=args.stream, stream_count=args.stream_count, dedupe=args.dedupe,
+                crowding=args.crowding, gm=gm, streamer=streamer)
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    run_from_args(args)
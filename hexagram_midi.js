@@ -1,23 +1,49 @@
 const fs = require("fs");
 const path = require("path");
 const m = require("max-api");
+const net = require("net");
 const { exec } = require("child_process");
 
 const watchDirectory = path.join(__dirname, "midi_generation");
 m.post(watchDirectory);
-fs.watch(watchDirectory, (eventType, filename) => {
-  if (eventType === "rename") {
-    const filePath = path.join(watchDirectory, filename);
-    if (fs.existsSync(filePath)) {
-      console.log(`New file detected: ${filename}`);
-
-      // Check if the file is a MIDI file
-      if (path.extname(filename).toLowerCase() === ".mid") {
-        // Send a message to Max to load and play the MIDI file
-        m.outlet(filePath);
-        m.post("midi");
-      }
+
+// The generator writes every file under a hidden temporary name, renames it
+// into place and finishes each batch with <batch>_manifest.json listing all
+// of its files. Files rendered while a run continues (--render_every) each
+// get their own <batch>_<n>_manifest.json as soon as they are written.
+// Reacting to manifests only means one update per batch or progressive file
+// and never a half-written file.
+const seenManifests = new Set();
+
+function isManifest(filename) {
+  return filename.endsWith("_manifest.json") && !filename.startsWith(".");
+}
+
+function readManifest(filename) {
+  if (seenManifests.has(filename)) {
+    return;
+  }
+  const manifestPath = path.join(watchDirectory, filename);
+  fs.readFile(manifestPath, "utf8", (err, data) => {
+    if (err) {
+      // Renamed away or deleted before we got to it
+      return;
     }
+    seenManifests.add(filename);
+    const manifest = JSON.parse(data);
+    m.post(`New batch ${manifest.batch}: ${manifest.count} files`);
+    manifest.files.forEach((file) => {
+      // Send a message to Max to load and play the MIDI file
+      m.outlet(path.join(watchDirectory, file.file));
+    });
+    m.post("midi");
+    listFiles();
+  });
+}
+
+fs.watch(watchDirectory, (eventType, filename) => {
+  if (eventType === "rename" && filename && isManifest(filename)) {
+    readManifest(filename);
   }
 });
 
@@ -33,7 +59,7 @@ function listFiles() {
     m.outlet("location", watchDirectory);
     // Output each file name
     files.forEach((file) => {
-      if (file !== ".DS_Store") {
+      if (path.extname(file).toLowerCase() === ".mid" && !file.startsWith(".")) {
         m.outlet("file", file);
       }
     });
@@ -45,14 +71,6 @@ m.addHandler("list_files", () => {
   listFiles();
 });
 
-// Watch for new files and list all files if a new one is added
-fs.watch(watchDirectory, (eventType, filename) => {
-  if (eventType === "rename" && filename !== ".DS_Store") {
-    m.post(`Change detected: ${filename}`);
-    listFiles();
-  }
-});
-
 m.post(`Watching for changes in: ${watchDirectory}`);
 
 // Handler to execute the Python script
@@ -91,6 +109,41 @@ m.addHandler("deleteAllFiles", () => {
 // This keeps the Node.js process open
 m.post("Node.js script is running...");
 
+// Address of the long-running generator started with `python3 ching_server.py`
+const generatorServer = { host: "127.0.0.1", port: 5757 };
+
+// Sends one generate request to the generator server. Calls onUnavailable when
+// no server is listening so the caller can fall back to a one-off process.
+function requestGeneration(params, onUnavailable) {
+  let buffer = "";
+  let connected = false;
+  const client = net.createConnection(generatorServer, () => {
+    connected = true;
+    client.write(JSON.stringify(params) + "\n");
+  });
+  client.on("data", (data) => {
+    buffer += data.toString();
+    const newline = buffer.indexOf("\n");
+    if (newline === -1) {
+      return;
+    }
+    const reply = JSON.parse(buffer.slice(0, newline));
+    if (reply.ok) {
+      m.post(`generated ${reply.paths.length} files`);
+    } else {
+      m.post(`generator error: ${reply.error}`);
+    }
+    client.end();
+  });
+  client.on("error", (err) => {
+    if (!connected) {
+      onUnavailable();
+    } else {
+      m.post(`generator connection error: ${err}`);
+    }
+  });
+}
+
 m.addHandler(
   "generate",
   (
@@ -102,31 +155,45 @@ m.addHandler(
     harmonicity,
     dynamics
   ) => {
-    let envName = "generative-music"; // Name of your Python environment
-    let pythonScriptPath = "./genetic_ching4.py"; // Path to your Python script
-
-    // Concatenate the command into a single line
-    let command =
-      `source ${envName}/bin/activate && ` +
-      `python3 ${pythonScriptPath} ` +
-      `--generations ${generation} ` +
-      `--population ${population} ` +
-      `--hexagram ${hexagram} ` +
-      `--base_duration ${baseDuration} ` +
-      `--mutation_rate ${mutation_rate} ` +
-      `--harmonicity_ratio ${harmonicity} ` +
-      `--dynamic_ratio ${dynamics}`;
-
-    exec(command, (err, stdout, stderr) => {
-      if (err) {
-        // Node couldn't execute the command
-        m.post(`exec error: ${err}`);
-        return;
-      }
-
-      // the *entire* stdout and stderr (buffered)
-      m.post(`stdout: ${stdout}`);
-      m.post(`stderr: ${stderr}`);
-    });
+    const params = {
+      generations: generation,
+      population: population,
+      hexagram: hexagram,
+      base_duration: baseDuration,
+      mutation_rate: mutation_rate,
+      harmonicity_ratio: harmonicity,
+      dynamic_ratio: dynamics,
+    };
+    requestGeneration(params, () => runGeneratorProcess(params));
   }
 );
+
+// Fallback when the generator server is not running: one Python process per request
+function runGeneratorProcess(params) {
+  let envName = "generative-music"; // Name of your Python environment
+  let pythonScriptPath = "./genetic_ching4.py"; // Path to your Python script
+
+  // Concatenate the command into a single line
+  let command =
+    `source ${envName}/bin/activate && ` +
+    `python3 ${pythonScriptPath} ` +
+    `--generations ${params.generations} ` +
+    `--population ${params.population} ` +
+    `--hexagram ${[].concat(params.hexagram).join(" ")} ` +
+    `--base_duration ${params.base_duration} ` +
+    `--mutation_rate ${params.mutation_rate} ` +
+    `--harmonicity_ratio ${params.harmonicity_ratio} ` +
+    `--dynamic_ratio ${params.dynamic_ratio}`;
+
+  exec(command, (err, stdout, stderr) => {
+    if (err) {
+      // Node couldn't execute the command
+      m.post(`exec error: ${err}`);
+      return;
+    }
+
+    // the *entire* stdout and stderr (buffered)
+    m.post(`stdout: ${stdout}`);
+    m.post(`stderr: ${stderr}`);
+  });
+}